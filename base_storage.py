@@ -0,0 +1,159 @@
+import abc
+
+# Колонки подписчиков при массовом импорте и выгрузке
+SUBSCRIBER_COLUMNS = {
+    'tg': ('user_id', 'chat_id', 'user_name', 'is_active'),
+    'yx': ('login', 'is_active')
+}
+
+
+class BaseStorage(abc.ABC):
+    # Интерфейс хранилища, от которого зависят Dispatcher, NewsBot,
+    # TelegramDelivery и YandexDeliveryBot. Реализации: NewsStorage (SQLite)
+    # и MemoryStorage (в памяти процесса, для нагрузочных замеров).
+
+    @abc.abstractmethod
+    async def connect(self):
+        pass
+
+    @abc.abstractmethod
+    async def close(self):
+        pass
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    # Подписчики
+
+    @abc.abstractmethod
+    async def add_user_tg(self, user_id, chat_id, user_name):
+        pass
+
+    @abc.abstractmethod
+    async def add_user_yx(self, login):
+        pass
+
+    @abc.abstractmethod
+    async def subscribe_user_tg(self, user_id):
+        pass
+
+    @abc.abstractmethod
+    async def unsubscribe_user_tg(self, user_id):
+        pass
+
+    @abc.abstractmethod
+    async def subscribe_user_yx(self, login):
+        pass
+
+    @abc.abstractmethod
+    async def unsubscribe_user_yx(self, login):
+        pass
+
+    @abc.abstractmethod
+    async def link_accounts(self, tg_id, yx_id):
+        pass
+
+    @abc.abstractmethod
+    async def get_tg_id_by_yx(self, yx_id):
+        pass
+
+    @abc.abstractmethod
+    async def check_active_tg(self, user_id):
+        pass
+
+    @abc.abstractmethod
+    async def check_active_yx(self, login):
+        pass
+
+    @abc.abstractmethod
+    async def check_exist_yx_login(self, login):
+        pass
+
+    @abc.abstractmethod
+    async def get_all_activate_users_tg(self):
+        pass
+
+    @abc.abstractmethod
+    async def get_all_activate_users_yx(self):
+        pass
+
+    @abc.abstractmethod
+    def iter_active_users_tg(self, chunk_size=1000):
+        # Асинхронный генератор пачек chat_id
+        pass
+
+    @abc.abstractmethod
+    def iter_active_users_yx(self, chunk_size=1000):
+        pass
+
+    @abc.abstractmethod
+    async def bulk_upsert_users(self, channel, rows):
+        pass
+
+    @abc.abstractmethod
+    def export_users(self, channel, chunk_size=1000):
+        # Асинхронный генератор пачек кортежей в порядке SUBSCRIBER_COLUMNS[channel]
+        pass
+
+    @abc.abstractmethod
+    async def deactivate_recipients(self, channel, failures):
+        pass
+
+    # Курсоры источников
+
+    @abc.abstractmethod
+    async def initialize_last_id(self, source_code, default_id=0):
+        pass
+
+    @abc.abstractmethod
+    async def get_last_id(self, source_code):
+        pass
+
+    @abc.abstractmethod
+    async def update_id(self, source_code, new_id, last_id):
+        pass
+
+    # Outbox и журнал доставки
+
+    @abc.abstractmethod
+    async def enqueue_news(self, source_code, new_id, last_id, payloads):
+        pass
+
+    @abc.abstractmethod
+    async def claim_outbox(self, channel, limit):
+        # Список (rowid, news_id, recipient, payload, attempts) готовых к отправке строк
+        pass
+
+    @abc.abstractmethod
+    async def finish_outbox(self, done_ids, failed_ids, deliveries=(), retries=()):
+        # Ошибка записи пробрасывается вызывающему, он повторяет запись итогов
+        pass
+
+    @abc.abstractmethod
+    async def reset_claimed_outbox(self):
+        # Восстановление после падения: вызывает только сервис при старте. Другие процессы
+        # (manage_users.py) открывают ту же БД, пока сервис рассылает, и outbox не трогают.
+        pass
+
+    @abc.abstractmethod
+    async def prune_deliveries(self, older_than, chunk_size=500):
+        pass
+
+    # Кэш загруженных картинок
+
+    @abc.abstractmethod
+    async def get_media_file_id(self, media_key, channel):
+        pass
+
+    @abc.abstractmethod
+    async def save_media_file_id(self, media_key, channel, file_id):
+        pass
+
+    @abc.abstractmethod
+    async def delete_media_file_id(self, media_key, channel, file_id):
+        # Удаляет запись, только если в ней все еще этот file_id
+        pass
@@ -25,7 +25,17 @@ class Config:
                     'api_url': os.getenv('HR_API_URL'),
                     'username': os.getenv('HR_USERNAME'),
                     'password': os.getenv('HR_PASSWORD'),
-                    'api_token': os.getenv('HR_API_TOKEN')
+                    'api_token': os.getenv('HR_API_TOKEN'),
+                    # Каталог архива сырых ответов; пусто - архив выключен
+                    'snapshot_dir': os.getenv('HR_SNAPSHOT_DIR'),
+                    # Файл с куками сессии портала (вход по логину и паролю)
+                    'session_file': os.getenv('HR_SESSION_FILE', 'data/hr_session.json'),
+                    # Часовой пояс дат публикации на портале, часы от UTC
+                    'utc_offset': float(os.getenv('HR_UTC_OFFSET', 3)),
+                    # Сколько страниц можно догрузить после простоя
+                    'catchup_max_pages': int(os.getenv('HR_CATCHUP_MAX_PAGES', 10)),
+                    # Общий секрет веб-хука /hr/webhook; пусто - только опрос
+                    'webhook_secret': os.getenv('HR_WEBHOOK_SECRET')
                 }
             elif section == 'yandex':
                 return { 
@@ -41,6 +51,35 @@ class Config:
                 return{
                     'base_url': os.getenv('SR_URL')
                 }
+            elif section == "http":
+                return {
+                    'limit': int(os.getenv('HTTP_POOL_LIMIT', 200)),
+                    'limit_per_host': int(os.getenv('HTTP_POOL_LIMIT_PER_HOST', 50)),
+                    'keepalive_timeout': float(os.getenv('HTTP_KEEPALIVE_TIMEOUT', 30)),
+                    'dns_cache_ttl': int(os.getenv('HTTP_DNS_CACHE_TTL', 300)),
+                    'timeout': float(os.getenv('HTTP_TIMEOUT', 30))
+                }
+            elif section == "polling":
+                # Часы и дни: "9-19" и "0-4" (0 - понедельник), смещение от UTC в часах
+                start, end = os.getenv('POLL_BUSINESS_HOURS', '9-19').split('-')
+                first, last = os.getenv('POLL_BUSINESS_DAYS', '0-4').split('-')
+                return {
+                    'min_interval': float(os.getenv('POLL_MIN_INTERVAL', 15)),
+                    'max_interval': float(os.getenv('POLL_MAX_INTERVAL', 120)),
+                    'off_hours_interval': float(os.getenv('POLL_OFF_HOURS_INTERVAL', 1800)),
+                    'backoff': float(os.getenv('POLL_BACKOFF', 2.0)),
+                    'jitter': float(os.getenv('POLL_JITTER', 0.1)),
+                    'business_hours': (int(start), int(end)),
+                    'business_days': tuple(range(int(first), int(last) + 1)),
+                    'utc_offset': float(os.getenv('HR_UTC_OFFSET', 3)),
+                    # Интервал сверочного опроса, когда новости приходят веб-хуком
+                    'reconcile_interval': float(os.getenv('POLL_RECONCILE_INTERVAL', 900))
+                }
+            elif section == "storage":
+                return {
+                    'backend': os.getenv('STORAGE_BACKEND', 'sqlite'),
+                    'db_name': os.getenv('STORAGE_DB_NAME', 'news.db')
+                }
 
         except Exception as ex:
             print(f"Ошибка конфигурации: {ex}")
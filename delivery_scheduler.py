@@ -0,0 +1,220 @@
+import asyncio
+import time
+from metrics import SEND_SECONDS, SENDS_TOTAL, QUEUE_DEPTH
+
+
+class RetryLater(Exception):
+
+    def __init__(self, retry_after):
+        super().__init__(f"Повтор через {retry_after} с")
+        self.retry_after = retry_after
+
+
+class PermanentFailure(Exception):
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def dead_recipients(jobs, results):
+    return [
+        (chat_id, result.reason)
+        for (chat_id, _), result in zip(jobs, results)
+        if isinstance(result, PermanentFailure)
+    ]
+
+
+async def iter_windows(recipients, size=1000):
+    # Рассылка идет окнами фиксированного размера: получатели берутся из списка
+    # или из асинхронного генератора пачек (NewsStorage.iter_active_users_*),
+    # поэтому память не растет вместе с аудиторией
+    window = []
+    if hasattr(recipients, '__aiter__'):
+        async for chunk in recipients:
+            for recipient in chunk:
+                window.append(recipient)
+                if len(window) >= size:
+                    yield window
+                    window = []
+    else:
+        for recipient in recipients:
+            window.append(recipient)
+            if len(window) >= size:
+                yield window
+                window = []
+    if window:
+        yield window
+
+
+class TokenBucket:
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def delay(self):
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        while True:
+            wait = self.delay()
+            if wait <= 0:
+                self.tokens -= 1
+                return
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+        self.updated = self.paused_until
+
+    def is_idle(self):
+        return self.delay() == 0 and self.tokens >= self.capacity
+
+
+class DeliveryScheduler:
+
+    def __init__(self, global_rate=30, per_chat_rate=1, workers=None, max_attempts=3, retry_delay=1.0,
+                 name='default'):
+        self.name = name
+        self.global_bucket = TokenBucket(global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.workers = workers or max(1, int(global_rate))
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._chat_buckets = {}
+        self._chat_tails = {}
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.per_chat_rate)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _forget_idle_chats(self):
+        idle = [
+            c for c, b in self._chat_buckets.items()
+            if b.is_idle() and c not in self._chat_tails
+        ]
+        for chat_id in idle:
+            del self._chat_buckets[chat_id]
+
+    def _chain(self, chat_id):
+        # Очередность сообщений одному получателю сохраняется и между
+        # параллельными вызовами run: каждое ждет предыдущее для этого chat_id
+        previous = self._chat_tails.get(chat_id)
+        done = asyncio.get_running_loop().create_future()
+        self._chat_tails[chat_id] = done
+        return previous, done
+
+    def _release(self, chat_id, done):
+        if not done.done():
+            done.set_result(None)
+        if self._chat_tails.get(chat_id) is done:
+            del self._chat_tails[chat_id]
+
+    async def run(self, jobs, send, attempts=None):
+        # jobs - список пар (chat_id, payload), send(chat_id, payload) -> bool.
+        # В результатах True, False (временная ошибка после всех попыток)
+        # или PermanentFailure, если получатель недоступен навсегда.
+        # attempts - необязательный список той же длины, в него пишется
+        # (число вызовов send, время первой и последней попытки по time.time()).
+        results = [False] * len(jobs)
+        chains = [self._chain(chat_id) for chat_id, _ in jobs]
+        queue = asyncio.Queue()
+        for index in range(len(jobs)):
+            queue.put_nowait(index)
+        remaining = len(jobs)
+        QUEUE_DEPTH.inc(self.name, amount=remaining)
+
+        async def worker():
+            nonlocal remaining
+            while True:
+                try:
+                    index = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+
+                chat_id, payload = jobs[index]
+                previous, done = chains[index]
+                if previous is not None:
+                    await previous
+
+                chat_bucket = self._chat_bucket(chat_id)
+                attempt = 0
+                tries = 0
+                first_attempt_at = None
+                while True:
+                    await chat_bucket.acquire()
+                    await self.global_bucket.acquire()
+
+                    # Повторы выполняются в этом же воркере, чтобы не нарушить очередность
+                    if first_attempt_at is None:
+                        first_attempt_at = time.time()
+                    tries += 1
+                    start = time.perf_counter()
+                    try:
+                        results[index] = await send(chat_id, payload)
+                    except RetryLater as ex:
+                        print(f"Превышен лимит отправки, пауза {ex.retry_after} с")
+                        SENDS_TOTAL.inc(self.name, 'retry')
+                        self.global_bucket.pause(ex.retry_after)
+                        chat_bucket.pause(ex.retry_after)
+                        continue
+                    except PermanentFailure as ex:
+                        print(f"Получатель {chat_id} недоступен: {ex.reason}")
+                        results[index] = ex
+                        SENDS_TOTAL.inc(self.name, 'dead')
+                        break
+                    except Exception as ex:
+                        print(f"Ошибка отправки для {chat_id}: {ex}")
+                        results[index] = False
+                    finally:
+                        SEND_SECONDS.observe(time.perf_counter() - start, self.name)
+
+                    attempt += 1
+                    if results[index] is True:
+                        SENDS_TOTAL.inc(self.name, 'success')
+                        break
+                    if attempt >= self.max_attempts:
+                        SENDS_TOTAL.inc(self.name, 'failure')
+                        break
+                    SENDS_TOTAL.inc(self.name, 'retry')
+                    await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+                if attempts is not None:
+                    attempts[index] = (tries, first_attempt_at, time.time())
+                remaining -= 1
+                QUEUE_DEPTH.dec(self.name)
+                self._release(chat_id, done)
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(self.workers, len(jobs)))]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            QUEUE_DEPTH.dec(self.name, amount=remaining)
+            for chat_id, (_, done) in zip((job[0] for job in jobs), chains):
+                self._release(chat_id, done)
+            self._forget_idle_chats()
+
+        return results
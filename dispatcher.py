@@ -1,45 +1,221 @@
 import time
 from telegram_delivery import TelegramDelivery
 from yandex_delivery import YandexDeliveryBot
+from news_renderer import NewsRenderer
+from delivery_scheduler import PermanentFailure
+from poll_scheduler import PollScheduler
+from metrics import HR_NEW_ITEMS, HR_PUSHED_ITEMS, HR_DETECTION_SECONDS, HR_POLL_INTERVAL, OUTBOX_IN_FLIGHT
 from datetime import datetime
 import asyncio
 
 class Dispatcher:
 
-    def __init__(self, adapter, storage, telegram, check_interval, yandex):
+    def __init__(self, adapter, storage, telegram, check_interval, yandex,
+                 batch_size=200, pipeline_depth=2, retention_days=30, retention_interval=3600,
+                 scheduler=None, retry_delay=30, retry_max_delay=1800, max_retries=12):
 
         self.adapter = adapter
         self.storage = storage
         self.telegram = telegram
         self.yandex = yandex
         self.check_interval = check_interval
+        # Без явного расписания check_interval - потолок паузы в рабочее время
+        self.scheduler = scheduler or PollScheduler(max_interval=check_interval)
+        self.batch_size = batch_size
+        self.pipeline_depth = pipeline_depth
+        self.retention_days = retention_days
+        self.retention_interval = retention_interval
+        # Временная ошибка после всех попыток планировщика не теряет сообщение: строка
+        # outbox откладывается с растущей паузой (по умолчанию около трех часов в сумме),
+        # 'failed' - только для недоступных получателей и исчерпанных повторов
+        self.retry_delay = retry_delay
+        self.retry_max_delay = retry_max_delay
+        self.max_retries = max_retries
         self.running = False
 
+        # Опрос и входящие веб-хуки портала читают и сдвигают один курсор - по очереди
+        self._ingest_lock = asyncio.Lock()
+        # id новостей, уже поставленных в рассылку по веб-хуку, но еще ниже курсора
+        self._pushed_ids = set()
+        self._background = set()
+        # Итоги доставки, которые не удалось записать в outbox: строки остаются 'sending'
+        # (повторно их никто не заберет), запись повторяется при следующей доставке
+        self._unfinished = []
+
+        self.channels = {
+            'tg': self.telegram,
+            'yx': self.yandex
+        }
+        self.renderer = NewsRenderer(self.channels)
+
     async def run_once(self):
         print(f"Проверка в {datetime.now().strftime('%H:%M:%S')}")
 
         total_new = 0
 
-        last_id = await self.storage.get_last_id(self.adapter.source_code)
-        print(f"Последний известный id: {last_id}")
+        await self.deliver_pending()
+
+        async with self._ingest_lock:
+            last_id = await self.storage.get_last_id(self.adapter.source_code)
+            print(f"Последний известный id: {last_id}")
+
+            if not last_id:
+                # Первый запуск: курсор ставится на текущую новость портала,
+                # архив подписчикам не рассылается
+                head_id = await self.adapter.get_head_row_id()
+                if head_id:
+                    await self.storage.update_id(self.adapter.source_code, head_id, last_id)
+                return total_new
 
-        new_news = await self.adapter.fetch_new_news(last_id)
+            new_news = await self.adapter.fetch_new_news(last_id)
 
-        if new_news:
-            max_id = self.adapter.build_news_id(max(int(n['id'].split('_')[1]) for n in new_news))
+            if not new_news:
+                return total_new
 
-            await self.storage.update_id(self.adapter.source_code, max_id, last_id)
+            max_id = max(n['row_id'] for n in new_news)
+            if not await self._enqueue(new_news, max_id, last_id):
+                return total_new
 
-            total_new += len(new_news)
-            
-            chat_ids = await self.storage.get_all_activate_users_tg()
-            logins = await self.storage.get_all_activate_users_yx()
-            for news in new_news:
-                success_tg = await self.telegram.send_to_many(news, chat_ids)
-                success_yx = await self.yandex.send_to_many(news, logins)
+            # Пришедшие по веб-хуку новости опрос только подтверждает: курсор
+            # сдвигается, а повторная постановка в outbox ничего не добавляет
+            fresh = [n for n in new_news if n['id'] not in self._pushed_ids]
+            self._pushed_ids.difference_update(n['id'] for n in new_news)
+
+        total_new += len(fresh)
+        HR_NEW_ITEMS.inc(amount=len(fresh))
+        self._observe_detection(fresh)
+
+        await self.deliver_pending()
 
         return total_new
 
+    async def ingest_pushed(self, items):
+        # Новости из веб-хука портала (в формате data.items) сразу идут в рассылку.
+        # Курсор не сдвигается: если портал не прислал какой-то веб-хук, новости
+        # с меньшими id все равно найдет опрос, который остается сверкой.
+        async with self._ingest_lock:
+            last_id = await self.storage.get_last_id(self.adapter.source_code)
+            new_news = await self.adapter.parse_pushed(items, last_id)
+            new_news = [n for n in new_news if n['id'] not in self._pushed_ids]
+
+            if not new_news or not await self._enqueue(new_news, last_id, last_id):
+                return 0
+
+            self._pushed_ids.update(n['id'] for n in new_news)
+
+        HR_NEW_ITEMS.inc(amount=len(new_news))
+        HR_PUSHED_ITEMS.inc(amount=len(new_news))
+        self._observe_detection(new_news)
+
+        # Ответ порталу не ждет доставки
+        task = asyncio.create_task(self.deliver_pending())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+        return len(new_news)
+
+    async def _enqueue(self, new_news, new_id, last_id):
+        payloads = []
+        for news in new_news:
+            for channel, payload in self.renderer.render(news).items():
+                payloads.append((news['id'], channel, payload))
+
+        return await self.storage.enqueue_news(
+            self.adapter.source_code, new_id, last_id, payloads
+        )
+
+    @staticmethod
+    def _observe_detection(new_news):
+        # Дата публикации на портале с точностью до минуты, отрицательные значения - это округление
+        detected_at = time.time()
+        for news in new_news:
+            published_ts = news.get('published_ts')
+            if published_ts is not None:
+                HR_DETECTION_SECONDS.observe(max(0.0, detected_at - published_ts))
+
+    async def deliver_pending(self):
+        await self._retry_unfinished()
+        # Каналы доставляются параллельно, время ограничено самым медленным из них
+        await asyncio.gather(*(
+            self._drain(channel, delivery)
+            for channel, delivery in self.channels.items()
+        ))
+
+    async def _drain(self, channel, delivery):
+        # Следующая пачка забирается из outbox, пока предыдущая еще отправляется.
+        # Порядок новостей для одного получателя сохраняет планировщик доставки.
+        in_flight = set()
+        try:
+            while True:
+                rows = await self.storage.claim_outbox(channel, self.batch_size)
+                if not rows:
+                    break
+
+                in_flight.add(asyncio.create_task(self._deliver_rows(channel, delivery, rows)))
+                if len(in_flight) >= self.pipeline_depth:
+                    done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    self._report_errors(channel, [task.exception() for task in done if not task.cancelled()])
+        finally:
+            if in_flight:
+                self._report_errors(channel, await asyncio.gather(*in_flight, return_exceptions=True))
+
+    @staticmethod
+    def _report_errors(channel, results):
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"Ошибка доставки пачки {channel}: {result}")
+
+    async def _deliver_rows(self, channel, delivery, rows):
+        OUTBOX_IN_FLIGHT.inc(channel, amount=len(rows))
+        attempts = [None] * len(rows)
+        try:
+            results = await delivery.deliver_batch(
+                [(recipient, payload) for _, _, recipient, payload, _ in rows], attempts
+            )
+        finally:
+            OUTBOX_IN_FLIGHT.dec(channel, amount=len(rows))
+
+        done = []
+        failed = []
+        retries = []
+        deliveries = []
+        now = time.time()
+        for (rowid, news_id, recipient, _, retried), result, attempt in zip(rows, results, attempts):
+            tries, first_attempt_at, finished_at = attempt or (0, now, now)
+            if result is True:
+                done.append(rowid)
+                deliveries.append((news_id, channel, recipient, 'delivered', tries, first_attempt_at, finished_at))
+            elif isinstance(result, PermanentFailure) or retried + 1 >= self.max_retries:
+                failed.append(rowid)
+                status = 'dead' if isinstance(result, PermanentFailure) else 'failed'
+                deliveries.append((news_id, channel, recipient, status, tries, first_attempt_at, None))
+            else:
+                delay = min(self.retry_delay * 2 ** retried, self.retry_max_delay)
+                retries.append((rowid, now + delay))
+                deliveries.append((news_id, channel, recipient, 'retrying', tries, first_attempt_at, None))
+
+        print(f"Доставка {channel}: успешно - {len(done)}, неудачно - {len(failed)}, "
+              f"отложено - {len(retries)}")
+        await self._finish(channel, (done, failed, deliveries, retries))
+
+    async def _finish(self, channel, outcome):
+        try:
+            await self.storage.finish_outbox(*outcome)
+        except Exception as ex:
+            print(f"Ошибка записи итогов доставки {channel}, повтор при следующей доставке: {ex}")
+            self._unfinished.append((channel, outcome))
+
+    async def _retry_unfinished(self):
+        unfinished, self._unfinished = self._unfinished, []
+        for channel, outcome in unfinished:
+            await self._finish(channel, outcome)
+
+    async def _retention_loop(self):
+        # Старые строки журнала доставки и outbox удаляются небольшими пачками
+        while True:
+            await self.storage.prune_deliveries(time.time() - self.retention_days * 86400)
+            await asyncio.sleep(self.retention_interval)
+
     async def stop(self):
         self.running = False
 
@@ -47,7 +223,10 @@ class Dispatcher:
 
         self.running = True
         print("Диспетчер запущен в режиме опроса")
-        print(f"Интервал проверки: {self.check_interval} секунд")
+        print(f"Интервал проверки: {self.scheduler.min_interval}-{self.scheduler.max_interval} секунд, "
+              f"вне рабочего времени до {self.scheduler.off_hours_interval} секунд")
+
+        retention_task = asyncio.create_task(self._retention_loop())
 
         try:
             while self.running:
@@ -56,13 +235,16 @@ class Dispatcher:
                 if new_count > 0:
                     print(f"Итого новых: {new_count}")
 
-                print(f"Следующая проверка через {self.check_interval} секунд")
+                delay = self.scheduler.next_delay(new_count)
+                HR_POLL_INTERVAL.set(delay)
+                print(f"Следующая проверка через {delay:.0f} секунд")
                 print()
-                await asyncio.sleep(self.check_interval)
+                await asyncio.sleep(delay)
 
         except KeyboardInterrupt:
             print("Диспетчер остановлен")
         finally:
+            retention_task.cancel()
             await self.stop()
     
 
@@ -1,15 +1,33 @@
 import aiohttp
 import asyncio
+import hashlib
 import json
-from bs4 import BeautifulSoup
-from datetime import datetime
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from yarl import URL
 from base_adapter import BaseNewsAdapter
 from storage import NewsStorage
 from config_loader import Config
+from html_extractor import extract_text
+from metrics import HR_POLL_SECONDS, HR_ITEMS_PARSED, HR_PARSE_CACHE_HITS, HR_NOT_MODIFIED, timed
+
+# Ответ портала не изменился с прошлого опроса
+NOT_MODIFIED = object()
+
+# Месяцы в датах публикации вида "11 фев 2026, 16:08"
+MONTHS = {
+    'янв': 1, 'фев': 2, 'мар': 3, 'апр': 4, 'мая': 5, 'май': 5, 'июн': 6,
+    'июл': 7, 'авг': 8, 'сен': 9, 'окт': 10, 'ноя': 11, 'дек': 12
+}
 
 class HRPortalAdapter(BaseNewsAdapter):
 
-    def __init__(self, base_url, api_url, username, password, api_token=None):
+    def __init__(self, base_url, api_url, username, password, api_token=None, http_client=None,
+                 catchup_concurrency=4, snapshot_archive=None, parsed_cache_size=256,
+                 session_file=None, utc_offset=3, catchup_max_pages=10):
 
         super().__init__(
             name = "HR Портал МояКоманада",
@@ -23,8 +41,41 @@ class HRPortalAdapter(BaseNewsAdapter):
         self.api_token = api_token
         self._login_needed = False
 
+        self.http_client = http_client
         self.session = None
 
+        # Куки сессии портала сохраняются в файл и переживают перезапуск.
+        # Повторный вход после 401/403 один на всех: остальные запросы ждут его
+        # под блокировкой и по номеру поколения понимают, что вход уже выполнен.
+        self.session_file = Path(session_file) if session_file else None
+        self._cookies_session = None
+        self._login_lock = asyncio.Lock()
+        self._auth_generation = 0
+
+        # Валидаторы прошлого ответа для условного GET и сырые новости из него
+        self._etag = None
+        self._last_modified = None
+        self._body_hash = None
+        self._last_items = None
+
+        # LRU разобранных новостей по (id, хэш полей новости): повторы и
+        # неизмененные новости не разбираются заново
+        self.parsed_cache_size = parsed_cache_size
+        self._parsed_cache = OrderedDict()
+
+        # Пагинация из последнего ответа первой страницы
+        self._total_pages = 1
+        self._per_page = 12
+        self.catchup_concurrency = catchup_concurrency
+        # Потолок догрузки: после долгого простоя старые новости не рассылаются
+        self.catchup_max_pages = catchup_max_pages
+        # SnapshotArchive или None: сохранение сырых ответов включается явно
+        self.snapshot_archive = snapshot_archive
+        # Часовой пояс, в котором портал показывает даты публикации
+        self.timezone = timezone(timedelta(hours=utc_offset))
+        # Разбор HTML идет в отдельных потоках, чтобы не блокировать event loop
+        self._parse_pool = None
+
         if api_token:
             self.headers = {'Authorization': f'Bearer {api_token}'}
         else:
@@ -32,11 +83,73 @@ class HRPortalAdapter(BaseNewsAdapter):
             self._login_needed = True
 
     async def connect(self):
-        if self.session is None or self.session.closed:
+        if self.http_client is not None:
+            self.session = await self.http_client.get_session()
+        elif self.session is None or self.session.closed:
             self.session = aiohttp.ClientSession(
                 timeout=aiohttp.ClientTimeout(total=30)
             )
 
+        if self._cookies_session is not self.session:
+            self._cookies_session = self.session
+            await self._restore_cookies()
+
+    async def _restore_cookies(self):
+        if self.api_token or self.session_file is None:
+            return
+
+        cookies = await asyncio.to_thread(self._read_cookies)
+        if cookies:
+            self.session.cookie_jar.update_cookies(cookies, response_url=URL(self.base_url))
+            # Сохраненная сессия проверяется первым же запросом, при 401/403 - новый вход
+            self._login_needed = False
+            print(f"Сессия портала восстановлена из {self.session_file}")
+
+    def _read_cookies(self):
+        try:
+            with open(self.session_file, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Ошибка чтения сессии портала: {e}")
+            return None
+
+    async def _save_cookies(self):
+        if self.session_file is None:
+            return
+
+        cookies = {
+            name: morsel.value
+            for name, morsel in self.session.cookie_jar.filter_cookies(URL(self.base_url)).items()
+        }
+        try:
+            await asyncio.to_thread(self._write_cookies, cookies)
+        except Exception as e:
+            print(f"Ошибка сохранения сессии портала: {e}")
+
+    def _write_cookies(self, cookies):
+        # Файл содержит действующую сессию - доступ только владельцу
+        self.session_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.session_file.with_suffix(self.session_file.suffix + '.tmp')
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, 'w', encoding='utf-8') as f:
+            json.dump(cookies, f)
+        os.replace(tmp_path, self.session_file)
+
+    async def _relogin(self, generation):
+        # generation - номер поколения входа, с которым был отправлен неудачный запрос
+        async with self._login_lock:
+            if generation != self._auth_generation:
+                return True
+
+            if not await self._login():
+                return False
+
+            self._auth_generation += 1
+            await self._save_cookies()
+            return True
+
     async def _login(self):
 
         try:
@@ -64,72 +177,241 @@ class HRPortalAdapter(BaseNewsAdapter):
             return False
 
         
-    async def _make_api_request(self):
-
+    async def _make_api_request(self, page=1):
+        # Условный запрос и сравнение по хэшу - только для первой страницы,
+        # остальные страницы запрашиваются лишь при догрузке после простоя
         try:
-            print(f"Запрос к {self.api_url}")
-            
-            if self._login_needed and not self.api_token:
-                if not await self._login():
-                    return None
-
             if self.session is None:
                 await self.connect()
 
-            async with self.session.get(
-                self.api_url,
-                headers=self.headers if self.api_token else {},
-                timeout=10
-            ) as response:
+            if self._login_needed and not self.api_token:
+                if not await self._relogin(self._auth_generation):
+                    return None
 
-                if response.status == 200:
-                    print("Успешно. Код ответа 200.")
-                    data = await response.json()
-                    return data
-                else:
-                    print(f"Ошибка. Код овтета {response.status}")
+            for attempt in range(2):
+                print(f"Запрос к {self.api_url}, страница {page}")
+                generation = self._auth_generation
+
+                headers = dict(self.headers) if self.api_token else {}
+                if page == 1 and self._last_items is not None:
+                    if self._etag:
+                        headers['If-None-Match'] = self._etag
+                    if self._last_modified:
+                        headers['If-Modified-Since'] = self._last_modified
+
+                async with self.session.get(
+                    self.api_url,
+                    headers=headers,
+                    params={'page': page} if page > 1 else None,
+                    timeout=10
+                ) as response:
+
+                    if response.status in (401, 403) and not self.api_token and attempt == 0:
+                        print(f"Сессия портала недействительна. Код ответа {response.status}")
+
+                    elif response.status == 304:
+                        print("Новости не изменились. Код ответа 304.")
+                        return NOT_MODIFIED
+
+                    elif response.status == 200:
+                        print("Успешно. Код ответа 200.")
+                        return await self._read_response(response, page)
+
+                    else:
+                        print(f"Ошибка. Код овтета {response.status}")
+                        return None
+
+                # Вход выполняется вне async with, чтобы соединение вернулось в пул
+                if not await self._relogin(generation):
                     return None
         
         except Exception as e:
             print(f"Ошибка запроса: {e}")
             return None
-    
-    async def fetch_news(self):
+
+    async def _read_response(self, response, page):
+        body = await response.read()
+        if page > 1:
+            return json.loads(body)
+
+        # Если портал не прислал валидаторы, изменения определяются по хэшу тела
+        body_hash = hashlib.sha256(body).digest()
+        if body_hash == self._body_hash and self._last_items is not None:
+            print("Новости не изменились, тело ответа совпадает с прошлым")
+            return NOT_MODIFIED
+
+        data = json.loads(body)
+        if self.snapshot_archive is not None:
+            # Архив только для отладки: ошибка записи (нет места, нет прав) не срывает опрос
+            try:
+                await self.snapshot_archive.save(body)
+            except Exception as ex:
+                print("Ошибка сохранения снимка ответа портала: ", ex)
+        self._etag = response.headers.get('ETag')
+        self._last_modified = response.headers.get('Last-Modified')
+        self._body_hash = body_hash
+        # Пока новый ответ не разобран, прошлый список считается устаревшим
+        self._last_items = None
+        return data
+
+    async def fetch_news(self, last_id=None):
+        # Если передан курсор, разбираются только новости новее него
         print("Попытка получения новостей.")
+        items = await self._fetch_first_page()
+        if items is None:
+            return None
+
+        if last_id is not None:
+            items = self._filter_new(items, last_id)
+        return await self._parse_items_async(items)
+
+    @timed(HR_POLL_SECONDS)
+    async def _fetch_first_page(self):
         data = await self._make_api_request()
 
+        if data is NOT_MODIFIED:
+            HR_NOT_MODIFIED.inc()
+            return self._last_items
+
         if data:
-            with open('hr_data.json', 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-                print("Данные сохранены в hr_data.json")
+            pagination = data['data'].get('pagination') or {}
+            self._total_pages = pagination.get('totalPages', 1)
+            self._per_page = pagination.get('perPage') or self._per_page
 
-                items = data['data']['items']
-                parsed_items = []
-                for item in items:
-                    parsed = self._parse_news_item(item)
-                    parsed = self._simple_truncate(parsed)
-                    parsed_items.append(parsed)
-                return parsed_items
+            self._last_items = data['data']['items']
+            return self._last_items
 
         else:
             print("Ошибка получния данных.")
             return None
-    
+
+    @staticmethod
+    def _filter_new(items, last_id):
+        # Отбор по сырому id до любого разбора HTML
+        return [item for item in items if int(item['id']) > last_id]
+
+    def _parse_items(self, items):
+        return [self._simple_truncate(self._parse_news_item(item)) for item in items]
+
+    @staticmethod
+    def _cache_key(item):
+        # Кроме content учитываются остальные используемые поля: правка заголовка
+        # или картинки тоже должна попасть в результат
+        fields = (item.get('content') or '', item.get('title') or '', item.get('category') or '',
+                  item.get('imagePreview') or '', item.get('createdAt') or '')
+        digest = hashlib.sha256('\0'.join(map(str, fields)).encode('utf-8')).digest()
+        return item['id'], digest
+
+    async def _parse_items_async(self, items):
+        # Кэш читается и пополняется только из event loop,
+        # в пул потоков уходят лишь новости, которых в нем нет
+        keys = [self._cache_key(item) for item in items]
+        parsed_items = [self._parsed_cache.get(key) for key in keys]
+        missing = [index for index, parsed in enumerate(parsed_items) if parsed is None]
+
+        if missing:
+            if self._parse_pool is None:
+                self._parse_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="hr-parser")
+            loop = asyncio.get_running_loop()
+            parsed = await loop.run_in_executor(
+                self._parse_pool, self._parse_items, [items[index] for index in missing]
+            )
+            for index, item in zip(missing, parsed):
+                parsed_items[index] = item
+                self._parsed_cache[keys[index]] = item
+            HR_ITEMS_PARSED.inc(amount=len(missing))
+
+        for key in keys:
+            self._parsed_cache.move_to_end(key)
+        while len(self._parsed_cache) > self.parsed_cache_size:
+            self._parsed_cache.popitem(last=False)
+
+        HR_PARSE_CACHE_HITS.inc(amount=len(items) - len(missing))
+        return parsed_items
+
+    async def _fetch_page(self, page):
+        data = await self._make_api_request(page)
+        if not data:
+            # Пропущенная страница означала бы потерянные новости - догрузка прерывается
+            raise RuntimeError(f"Не удалось получить страницу {page}")
+        return data['data']['items']
+
+    async def iter_news_pages(self, last_id):
+        # Новые новости (row_id > last_id) отдаются постранично по мере прихода страниц
+        # (fetch_new_news все равно собирает их целиком перед постановкой в outbox).
+        # Если первая страница целиком новее курсора, разрыв оценивается по id:
+        # id растут, поэтому между курсором и самой старой новостью не больше
+        # (oldest - last_id) новостей. Нужные страницы запрашиваются параллельно.
+        items = await self._fetch_first_page()
+        if not items:
+            return
+
+        yield await self._parse_items_async(self._filter_new(items, last_id))
+
+        oldest = min(int(item['id']) for item in items)
+        next_page = 2
+        max_page = min(self._total_pages, self.catchup_max_pages)
+        while oldest > last_id and next_page <= max_page:
+            missing_pages = -(-(oldest - last_id) // self._per_page)
+            last_page = min(max_page, next_page + missing_pages - 1)
+            print(f"Догрузка страниц {next_page}-{last_page}")
+
+            semaphore = asyncio.Semaphore(self.catchup_concurrency)
+
+            async def fetch(page):
+                async with semaphore:
+                    return await self._fetch_page(page)
+
+            tasks = [asyncio.create_task(fetch(page)) for page in range(next_page, last_page + 1)]
+            try:
+                for task in asyncio.as_completed(tasks):
+                    page_items = await task
+                    if page_items:
+                        oldest = min(oldest, min(int(item['id']) for item in page_items))
+                    yield await self._parse_items_async(self._filter_new(page_items, last_id))
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+            next_page = last_page + 1
+
+        if oldest > last_id and max_page < self._total_pages:
+            print(f"Догрузка ограничена {max_page} страницами, более старые новости пропущены")
+
+    async def parse_pushed(self, items, last_id):
+        # Новости из веб-хука портала: тот же формат, что data.items, тот же разбор.
+        # Правки уже разосланных новостей (id не больше курсора) пропускаются.
+        new_items = {}
+        for item in items:
+            try:
+                row_id = int(item['id'])
+                item['title']
+            except Exception:
+                print(f"Пропущена новость без id или заголовка: {item!r:.200}")
+                continue
+            new_items[row_id] = item
+
+        fresh = [new_items[row_id] for row_id in sorted(new_items) if row_id > last_id]
+        return await self._parse_items_async(fresh)
+
     async def fetch_new_news(self, last_id):
         print("Получение новой новости")
-        items = await self.fetch_news()
-        
-        if not items:
-            return []
 
-        new_items = []
+        # last_id - целочисленный курсор источника, сравниваем с row_id без разбора строк.
+        # Закрепленные новости могут повторяться на страницах, поэтому словарь по row_id.
+        # Страницы разбираются по мере прихода, но в рассылку новости уходят только после
+        # последней страницы: курсор сдвигается сравнением с обменом сразу на весь разрыв.
+        new_items = {}
+        try:
+            async for page_items in self.iter_news_pages(last_id):
+                for item in page_items:
+                    new_items[item['row_id']] = item
+        except Exception as e:
+            print(f"Ошибка догрузки новостей: {e}")
+            return []
 
-        for item in items:
-            if self.rebuild_news_id(item['id']) > self.rebuild_news_id(last_id):
-                new_items.append(item)
-        
         print("Найдно новых новостей: ", len(new_items))
-        return sorted(new_items, key = lambda item: item['id'])
+        return sorted(new_items.values(), key = lambda item: item['row_id'])
 
     def build_news_id(self, row_id):
         return f"hr_{row_id}"
@@ -137,8 +419,26 @@ class HRPortalAdapter(BaseNewsAdapter):
     def rebuild_news_id(self, row_id):
         return int(row_id[3:])
     
-    def _create_news_link(self, news_id):
-        return f"{self.base_url}/news/detail/{news_id[3:]}"
+    async def download_image(self, url):
+        try:
+            if self.session is None:
+                await self.connect()
+
+            async with self.session.get(
+                url,
+                headers=self.headers if self.api_token else {},
+                timeout=30
+            ) as response:
+                if response.status == 200:
+                    return await response.read()
+                print(f"Ошибка загрузки картинки: {response.status}")
+                return None
+        except Exception as e:
+            print(f"Ошибка загрузки картинки: {e}")
+            return None
+
+    def _create_news_link(self, row_id):
+        return f"{self.base_url}/news/detail/{row_id}"
 
     def _make_absolute_url(self, url):
 
@@ -150,63 +450,38 @@ class HRPortalAdapter(BaseNewsAdapter):
        
        content_html = item.get('content', '')
        clean_content = self._extract_text_from_html(content_html)
-       news_id = self.build_news_id(item['id'])
+       row_id = int(item['id'])
+       news_id = self.build_news_id(row_id)
        image_url = self._make_absolute_url(item.get('imagePreview'))
 
 
        return {
         'id': news_id,
+        'row_id': row_id,
         'title': item['title'],
         'content': clean_content,
         'rubric': item.get('category', 'Без рубрики'),
-        'link': self._create_news_link(news_id),
-        'published_at': item.get('createdAt', 'unknown')
+        'link': self._create_news_link(row_id),
+        'image_url': image_url,
+        'published_at': item.get('createdAt', 'unknown'),
+        'published_ts': self._parse_published_at(item.get('createdAt'))
        }
 
-
-    def _extract_text_from_html(self, html_content):
-
-        if not html_content: return ""
-
+    def _parse_published_at(self, value):
+        # "11 фев 2026, 16:08" -> unix time; None, если формат другой
         try:
+            date, clock = value.split(',')
+            day, month, year = date.split()
+            hour, minute = clock.split(':')
+            published = datetime(int(year), MONTHS[month.lower().rstrip('.')[:3]], int(day),
+                                 int(hour), int(minute), tzinfo=self.timezone)
+            return published.timestamp()
+        except Exception:
+            return None
 
-            soup = BeautifulSoup(html_content, 'html.parser')
-
-            for tag in soup.find_all(['script', 'style', 'img', 'frame', 'video']):
-                tag.decompose()
-
-            for span in soup.find_all('span', class_='an1'):
-                emoji = span.get('char', '') or span.get_text(strip=True)
-                if emoji:
-                    span.replace_with(emoji)
-                else:
-                    span.decompose()
-            
-            for mention in soup.find_all('mention'):
-                user_name = mention.get('label', '') or mention.get_text(strip=True)
-                if user_name:
-                    mention.replace_with(f"@{user_name}")
-                else:
-                    mention.decompose()
-            
-            for br in soup.find_all('br'):
-                br.replace_with('\n')
-
-            for tag in soup.find_all(['span', 'em', 'strong', 'b', 'i', 'u']):
-                tag.replace_with(tag.get_text()) 
-            
-            for p in soup.find_all('p'):
-                if not p.get_text(strip=True):
-                    p.decompose()
-
-            text = soup.get_text(separator=' ', strip=True)
-
-            text = ' '.join(text.split())
-
-        except Exception as e:
-            text = f"Ошибка парсинга HTML: {e}"
 
-        return text
+    def _extract_text_from_html(self, html_content):
+        return extract_text(html_content)
 
     def _simple_truncate(self, item, max_length = 200):
         text = item.get('content', '')
@@ -222,17 +497,24 @@ class HRPortalAdapter(BaseNewsAdapter):
             item['content'] = trunced + "..."            
         return item
 
+    async def get_head_row_id(self):
+        # Самый новый id на первой странице - начальное значение курсора
+        items = await self._fetch_first_page()
+        if not items:
+            return None
+        return max(int(item['id']) for item in items)
+
     async def get_last_news_id(self):
 
         try:
-            items= await self.fetch_news()
+            # Нужен только id первой новости - HTML не разбирается
+            items = await self._fetch_first_page()
 
             if not items:
                 print("Новости отсутствуют")
                 return None
             
-            last_news =  items[0]
-            last_id = last_news['id']
+            last_id = self.build_news_id(int(items[0]['id']))
 
             print("Получен последний ID на портале: ", last_id)
             return last_id
@@ -242,9 +524,12 @@ class HRPortalAdapter(BaseNewsAdapter):
             return None
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        if self.session and not self.session.closed:
+        if self.http_client is None and self.session and not self.session.closed:
             await self.session.close()
             print('Сессия закрыта')
+        if self._parse_pool is not None:
+            self._parse_pool.shutdown()
+            self._parse_pool = None
 
     async def __aenter__(self):
         await self.connect()
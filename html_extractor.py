@@ -0,0 +1,211 @@
+from html.parser import HTMLParser
+
+# Теги, содержимое которых в текст не попадает
+SKIP_TAGS = {'script', 'style', 'img', 'frame', 'video'}
+
+# Строчные теги: их текст склеивается без разделителя, как tag.get_text()
+INLINE_TAGS = {'span', 'em', 'strong', 'b', 'i', 'u'}
+
+# Пустые элементы, как их понимает BeautifulSoup: закрывающего тега у них нет
+VOID_TAGS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem',
+    'meta', 'param', 'source', 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame',
+    'image', 'isindex', 'nextid', 'spacer'
+}
+
+
+class _TextExtractor(HTMLParser):
+    # Один проход по HTML без построения дерева. Повторяет результат
+    # extract_text_bs4: эмодзи из span.an1 (атрибут char), @label для mention,
+    # текст строчных тегов одним куском, остальные куски через пробел.
+    # Стек открытых тегов закрывается так же, как в BeautifulSoup: закрывающий
+    # тег без пары пропускается, иначе закрывает и все вложенные в него.
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.chunks = []
+        self.stack = []
+        self.skip_depth = 0
+        self.inline_depth = 0
+        self.inline_buffer = []
+        # Замены для span.an1 / mention: [вид, атрибут, собранный внутренний текст]
+        self.replacements = []
+
+    def _emit(self, text):
+        if self.replacements:
+            self.replacements[-1][2].append(text)
+        elif self.inline_depth:
+            self.inline_buffer.append(text)
+        else:
+            self.chunks.append(text)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in VOID_TAGS:
+            if tag == 'br' and not self.skip_depth and not self.replacements:
+                self._emit('\n')
+            return
+
+        attrs = dict(attrs)
+        if tag in SKIP_TAGS:
+            kind = 'skip'
+            self.skip_depth += 1
+        elif tag == 'span' and 'an1' in (attrs.get('class') or '').split():
+            kind = 'an1'
+            self.replacements.append(['an1', attrs.get('char'), []])
+        elif tag == 'mention':
+            kind = 'mention'
+            self.replacements.append(['mention', attrs.get('label'), []])
+        elif tag in INLINE_TAGS:
+            kind = 'inline'
+            self.inline_depth += 1
+        else:
+            kind = None
+        self.stack.append((tag, kind))
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        for index in range(len(self.stack) - 1, -1, -1):
+            if self.stack[index][0] == tag:
+                break
+        else:
+            return
+
+        while len(self.stack) > index:
+            self._close(self.stack.pop()[1])
+
+    def _close(self, kind):
+        if kind == 'skip':
+            self.skip_depth -= 1
+        elif kind in ('an1', 'mention'):
+            self._close_replacement()
+        elif kind == 'inline':
+            self.inline_depth -= 1
+            if not self.inline_depth:
+                self.chunks.append(''.join(self.inline_buffer))
+                self.inline_buffer = []
+
+    def _close_replacement(self):
+        kind, value, inner = self.replacements.pop()
+        inner = ''.join(inner)
+        if self.skip_depth:
+            return
+
+        if kind == 'mention' and any(outer[0] == 'an1' for outer in self.replacements):
+            # span.an1 заменяется раньше mention, поэтому внутри него mention - просто текст
+            self._emit(inner)
+            return
+
+        value = value or inner.strip()
+        if value:
+            self._emit('@' + value if kind == 'mention' else value)
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self._emit(data)
+
+    def text(self):
+        self.close()
+        while self.stack:
+            self._close(self.stack.pop()[1])
+        # Как get_text(separator=' ', strip=True) и схлопывание пробелов
+        return ' '.join(word for chunk in self.chunks for word in chunk.split())
+
+
+def extract_text(html_content):
+    if not html_content:
+        return ""
+
+    try:
+        parser = _TextExtractor()
+        parser.feed(html_content)
+        return parser.text()
+    except Exception as e:
+        return f"Ошибка парсинга HTML: {e}"
+
+
+def extract_text_bs4(html_content):
+    # Прежняя реализация на BeautifulSoup - эталон для проверки и замера
+    from bs4 import BeautifulSoup
+
+    if not html_content: return ""
+
+    try:
+
+        soup = BeautifulSoup(html_content, 'html.parser')
+
+        for tag in soup.find_all(['script', 'style', 'img', 'frame', 'video']):
+            tag.decompose()
+
+        for span in soup.find_all('span', class_='an1'):
+            emoji = span.get('char', '') or span.get_text(strip=True)
+            if emoji:
+                span.replace_with(emoji)
+            else:
+                span.decompose()
+
+        for mention in soup.find_all('mention'):
+            user_name = mention.get('label', '') or mention.get_text(strip=True)
+            if user_name:
+                mention.replace_with(f"@{user_name}")
+            else:
+                mention.decompose()
+
+        for br in soup.find_all('br'):
+            br.replace_with('\n')
+
+        for tag in soup.find_all(['span', 'em', 'strong', 'b', 'i', 'u']):
+            tag.replace_with(tag.get_text())
+
+        for p in soup.find_all('p'):
+            if not p.get_text(strip=True):
+                p.decompose()
+
+        text = soup.get_text(separator=' ', strip=True)
+
+        text = ' '.join(text.split())
+
+    except Exception as e:
+        text = f"Ошибка парсинга HTML: {e}"
+
+    return text
+
+
+def main():
+    # Проверка совпадения с прежней реализацией и замер на hr_data.json:
+    # python html_extractor.py [файл ответа портала]
+    import json
+    import sys
+    import time
+
+    path = sys.argv[1] if len(sys.argv) > 1 else "hr_data.json"
+    with open(path, encoding='utf-8') as f:
+        items = json.load(f)['data']['items']
+    documents = [item.get('content', '') for item in items]
+
+    mismatches = 0
+    for item, html_content in zip(items, documents):
+        expected = extract_text_bs4(html_content)
+        actual = extract_text(html_content)
+        if expected != actual:
+            mismatches += 1
+            print(f"Расхождение в новости {item['id']}:\n  bs4:  {expected!r}\n  new:  {actual!r}")
+    print(f"Проверено новостей: {len(documents)}, расхождений: {mismatches}")
+
+    rounds = 50
+    for name, extractor in (("BeautifulSoup", extract_text_bs4), ("однопроходный", extract_text)):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for html_content in documents:
+                extractor(html_content)
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {elapsed / rounds * 1000:.2f} мс на страницу")
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
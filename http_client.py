@@ -0,0 +1,124 @@
+import asyncio
+import aiohttp
+from aiogram.client.session.aiohttp import AiohttpSession
+from telegram.error import NetworkError, TimedOut
+from telegram.request import BaseRequest
+
+
+class HttpClient:
+
+    def __init__(self, limit=200, limit_per_host=50, keepalive_timeout=30,
+                 dns_cache_ttl=300, timeout=30):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.timeout = timeout
+        self._session = None
+
+    @classmethod
+    def from_config(cls, config):
+        http_config = config.load_config('http')
+        return cls(**http_config)
+
+    async def get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.dns_cache_ttl
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+            print(f"HTTP пул: всего {self.limit}, на хост {self.limit_per_host}")
+        return self._session
+
+    def telegram_request(self):
+        return SharedTelegramRequest(self)
+
+    def aiogram_session(self):
+        return SharedAiogramSession(self)
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+            print("HTTP пул закрыт")
+
+    async def __aenter__(self):
+        await self.get_session()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+class SharedTelegramRequest(BaseRequest):
+    # Транспорт python-telegram-bot поверх общего aiohttp-пула вместо отдельного httpx
+
+    def __init__(self, client, read_timeout=5.0):
+        self.client = client
+        self._read_timeout = read_timeout
+
+    @property
+    def read_timeout(self):
+        return self._read_timeout
+
+    async def initialize(self):
+        await self.client.get_session()
+
+    async def shutdown(self):
+        # Пул закрывает его владелец - HttpClient
+        pass
+
+    def _timeout(self, value, default):
+        return default if value is BaseRequest.DEFAULT_NONE else value
+
+    async def do_request(self, url, method, request_data=None,
+                         read_timeout=BaseRequest.DEFAULT_NONE,
+                         write_timeout=BaseRequest.DEFAULT_NONE,
+                         connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE):
+        session = await self.client.get_session()
+
+        timeout = aiohttp.ClientTimeout(
+            total=None,
+            sock_connect=self._timeout(connect_timeout, 5.0),
+            sock_read=self._timeout(read_timeout, self._read_timeout)
+        )
+
+        kwargs = {}
+        if request_data is not None and request_data.multipart_data:
+            form = aiohttp.FormData()
+            for name, value in request_data.json_parameters.items():
+                form.add_field(name, value)
+            for name, (filename, content, mimetype) in request_data.multipart_data.items():
+                form.add_field(name, content, filename=filename, content_type=mimetype)
+            kwargs['data'] = form
+        elif request_data is not None:
+            # Как и HTTPXRequest: значения уже сериализованы в строки, отправляем формой
+            kwargs['data'] = request_data.json_parameters
+
+        try:
+            async with session.request(method, url, timeout=timeout, **kwargs) as response:
+                return response.status, await response.read()
+        except asyncio.TimeoutError as err:
+            raise TimedOut from err
+        except aiohttp.ClientError as err:
+            raise NetworkError(f"aiohttp.{err.__class__.__name__}: {err}") from err
+
+
+class SharedAiogramSession(AiohttpSession):
+    # Сессия aiogram, которая берет соединения из общего пула
+
+    def __init__(self, client, **kwargs):
+        super().__init__(**kwargs)
+        self.client = client
+
+    async def create_session(self):
+        return await self.client.get_session()
+
+    async def close(self):
+        pass
@@ -0,0 +1,82 @@
+import asyncio
+import hashlib
+import os
+import threading
+from pathlib import Path
+
+IMAGE_SIGNATURES = {
+    b'\x89PNG': '.png',
+    b'\xff\xd8\xff': '.jpg',
+    b'GIF8': '.gif',
+    b'RIFF': '.webp'
+}
+
+
+class ImageCache:
+
+    def __init__(self, cache_dir="data/images", max_bytes=200 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def _extension(data):
+        for signature, extension in IMAGE_SIGNATURES.items():
+            if data.startswith(signature):
+                return extension
+        return '.bin'
+
+    def get(self, digest):
+        for path in self.cache_dir.glob(f"{digest}.*"):
+            # Недописанный файл параллельного put сейчас будет переименован
+            if path.suffix == '.tmp':
+                continue
+            # mtime служит отметкой последнего использования для LRU
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                # Файл только что удалило вытеснение
+                continue
+            return path
+        return None
+
+    async def put(self, data: bytes):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.get(digest)
+        if path is not None:
+            return path
+
+        path = self.cache_dir / f"{digest}{self._extension(data)}"
+        await asyncio.to_thread(self._write, path, data)
+        await asyncio.to_thread(self._evict, path)
+        return path
+
+    def _write(self, path, data):
+        # Свой временный файл у каждой записи: параллельные put одной картинки не мешают друг другу
+        tmp_path = path.with_suffix(f"{path.suffix}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+    def _evict(self, keep):
+        files = []
+        total = 0
+        for path in self.cache_dir.iterdir():
+            if path.suffix == '.tmp':
+                continue
+            stat = path.stat()
+            files.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
+            print(f"Картинка удалена из кэша: {path.name}")
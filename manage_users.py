@@ -0,0 +1,85 @@
+import argparse
+import asyncio
+import csv
+import json
+from pathlib import Path
+from storage import NewsStorage
+from base_storage import SUBSCRIBER_COLUMNS
+
+# Массовый импорт и выгрузка подписчиков:
+#   python manage_users.py import tg users.csv
+#   python manage_users.py export yx logins.jsonl
+# Формат определяется по расширению: .csv (с заголовком) или .jsonl
+
+
+def _convert(channel, record):
+    # Строка файла -> кортеж в порядке SUBSCRIBER_COLUMNS, is_active по умолчанию 1
+    values = []
+    for column in SUBSCRIBER_COLUMNS[channel]:
+        value = record.get(column)
+        if column == 'is_active':
+            value = 1 if value in (None, '') else int(str(value).lower() in ('1', 'true'))
+        elif column in ('user_id', 'chat_id'):
+            value = int(value)
+        values.append(value)
+    return tuple(values)
+
+
+def read_rows(channel, path):
+    # Ленивое чтение: файл читается построчно в потоке писателя БД
+    path = Path(path)
+    with open(path, encoding='utf-8', newline='') as f:
+        if path.suffix == '.csv':
+            records = csv.DictReader(f)
+        else:
+            records = (json.loads(line) for line in f if line.strip())
+
+        for record in records:
+            yield _convert(channel, record)
+
+
+async def import_users(storage, channel, path):
+    return await storage.bulk_upsert_users(channel, read_rows(channel, path))
+
+
+async def export_users(storage, channel, path):
+    path = Path(path)
+    columns = SUBSCRIBER_COLUMNS[channel]
+    count = 0
+
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        if path.suffix == '.csv':
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            write_chunk = writer.writerows
+        else:
+            def write_chunk(chunk):
+                f.writelines(
+                    json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n'
+                    for row in chunk
+                )
+
+        async for chunk in storage.export_users(channel):
+            await asyncio.to_thread(write_chunk, chunk)
+            count += len(chunk)
+
+    print(f"Выгружено пользователей {channel}: {count}")
+    return count
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Импорт и выгрузка подписчиков")
+    parser.add_argument('action', choices=['import', 'export'])
+    parser.add_argument('channel', choices=sorted(SUBSCRIBER_COLUMNS))
+    parser.add_argument('path')
+    args = parser.parse_args()
+
+    async with NewsStorage() as storage:
+        if args.action == 'import':
+            await import_users(storage, args.channel, args.path)
+        else:
+            await export_users(storage, args.channel, args.path)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,355 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from datetime import datetime, timezone
+from base_storage import BaseStorage, SUBSCRIBER_COLUMNS
+from subscriber_registry import SubscriberRegistry
+
+
+class MemoryStorage(BaseStorage):
+    # Хранилище целиком в памяти процесса, без диска и потоков. Повторяет поведение
+    # NewsStorage, чтобы нагрузочные замеры доставки и разбора не зависели от SQLite.
+    # Данные не переживают перезапуск.
+
+    def __init__(self):
+        self.subscribers = SubscriberRegistry()
+        self.user_names = {}
+        self.link_pairs = set()
+
+        self.cursors = {}
+
+        self.outbox_news = {}
+        self.outbox = {}
+        self._outbox_keys = {}
+        self._pending = {}
+        # Отложенные после временной ошибки строки: куча (next_attempt_at, rowid) по каналам
+        self._delayed = {}
+        self._rowids = itertools.count(1)
+
+        self.deliveries = {}
+        self.deliveries_daily = {}
+        self.media_cache = {}
+
+    async def connect(self):
+        await self.initialize_last_id("hr_portal", 0)
+        print("Хранилище в памяти готово")
+
+    async def close(self):
+        print("Хранилище в памяти закрыто")
+
+    # Подписчики
+
+    async def add_user_tg(self, user_id, chat_id, user_name):
+        self.subscribers.put_tg(user_id, chat_id)
+        self.user_names[user_id] = user_name
+
+    async def add_user_yx(self, login):
+        self.subscribers.put_yx(login)
+
+    async def subscribe_user_tg(self, user_id):
+        self.subscribers.set_active_tg(user_id, True)
+        return True
+
+    async def unsubscribe_user_tg(self, user_id):
+        self.subscribers.set_active_tg(user_id, False)
+        return True
+
+    async def subscribe_user_yx(self, login):
+        self.subscribers.set_active_yx(login, True)
+        return True
+
+    async def unsubscribe_user_yx(self, login):
+        self.subscribers.set_active_yx(login, False)
+        return True
+
+    async def link_accounts(self, tg_id, yx_id):
+        # Как и первичный ключ user_tg_yx: повторная привязка - ошибка
+        if (tg_id, yx_id) in self.link_pairs:
+            raise ValueError(f"Аккаунты {tg_id} и {yx_id} уже привязаны")
+        self.link_pairs.add((tg_id, yx_id))
+        self.subscribers.link(tg_id, yx_id)
+
+    async def get_tg_id_by_yx(self, yx_id):
+        return self.subscribers.tg_id_by_yx(yx_id)
+
+    async def check_active_tg(self, user_id):
+        return self.subscribers.is_active_tg(user_id)
+
+    async def check_active_yx(self, login):
+        return self.subscribers.is_active_yx(login)
+
+    async def check_exist_yx_login(self, login):
+        return self.subscribers.has_yx(login)
+
+    async def get_all_activate_users_tg(self):
+        return self.subscribers.active_chat_ids()
+
+    async def get_all_activate_users_yx(self):
+        return self.subscribers.active_logins()
+
+    async def iter_active_users_tg(self, chunk_size=1000):
+        for chunk in self._chunks(sorted(self.subscribers.active_chat_ids()), chunk_size):
+            yield chunk
+
+    async def iter_active_users_yx(self, chunk_size=1000):
+        for chunk in self._chunks(sorted(self.subscribers.active_logins()), chunk_size):
+            yield chunk
+
+    @staticmethod
+    def _chunks(items, chunk_size):
+        for start in range(0, len(items), chunk_size):
+            yield items[start:start + chunk_size]
+
+    async def bulk_upsert_users(self, channel, rows):
+        count = 0
+        for row in rows:
+            record = dict(zip(SUBSCRIBER_COLUMNS[channel], row))
+            is_active = record.get('is_active', 1)
+            if channel == 'tg':
+                await self.add_user_tg(record['user_id'], record['chat_id'], record['user_name'])
+                self.subscribers.set_active_tg(record['user_id'], is_active)
+            else:
+                await self.add_user_yx(record['login'])
+                self.subscribers.set_active_yx(record['login'], is_active)
+            count += 1
+
+        print(f"Импортировано пользователей {channel}: {count}")
+        return count
+
+    async def export_users(self, channel, chunk_size=1000):
+        registry = self.subscribers
+        if channel == 'tg':
+            rows = sorted(
+                (user_id, chat_id, self.user_names.get(user_id), active)
+                for user_id, chat_id, active
+                in zip(registry.tg_user_ids, registry.tg_chat_ids, registry.tg_active)
+            )
+        else:
+            rows = sorted(zip(registry.yx_logins, registry.yx_active))
+
+        for chunk in self._chunks(rows, chunk_size):
+            yield chunk
+
+    async def deactivate_recipients(self, channel, failures):
+        recipients = [recipient for recipient, _ in failures]
+        if channel == 'tg':
+            self.subscribers.deactivate_tg_chats(recipients)
+        else:
+            self.subscribers.deactivate_yx_logins(recipients)
+
+        dead = {str(recipient) for recipient in recipients}
+        delayed = (rowid for _, rowid in self._delayed.get(channel, ()))
+        for rowid in itertools.chain(self._pending.get(channel, ()), delayed):
+            row = self.outbox.get(rowid)
+            if row is not None and row[3] == 'pending' and row[2] in dead:
+                row[3] = 'failed'
+
+        print(f"Отключено недоступных получателей {channel}: {len(failures)}")
+
+    # Курсоры источников
+
+    async def initialize_last_id(self, source_code, default_id=0):
+        self.cursors.setdefault(source_code, default_id)
+
+    async def get_last_id(self, source_code):
+        return self.cursors.get(source_code)
+
+    async def update_id(self, source_code, new_id, last_id):
+        if self.cursors.get(source_code) == last_id:
+            self.cursors[source_code] = new_id
+            print(f"Обновлен last_id для {source_code}: {new_id}")
+
+    # Outbox и журнал доставки
+
+    async def enqueue_news(self, source_code, new_id, last_id, payloads):
+        if self.cursors.get(source_code) != last_id:
+            print(f"Ошибка постановки в очередь: курсор {source_code} уже изменен, ожидался {last_id}")
+            return False
+
+        recipients = {
+            'tg': [str(chat_id) for chat_id in self.subscribers.active_chat_ids()],
+            'yx': self.subscribers.active_logins()
+        }
+
+        for news_id, channel, payload in payloads:
+            self.outbox_news[(news_id, channel)] = payload
+            pending = self._pending.setdefault(channel, deque())
+            for recipient in recipients.get(channel, []):
+                key = (news_id, channel, recipient)
+                if key in self._outbox_keys:
+                    continue
+                rowid = next(self._rowids)
+                self._outbox_keys[key] = rowid
+                # news_id, channel, recipient, status, updated_at, attempts, next_attempt_at
+                self.outbox[rowid] = [news_id, channel, recipient, 'pending', time.time(), 0, 0.0]
+                pending.append(rowid)
+
+        self.cursors[source_code] = new_id
+        print(f"Обновлен last_id для {source_code}: {new_id}")
+        return True
+
+    async def claim_outbox(self, channel, limit):
+        now = time.time()
+        pending = self._pending.setdefault(channel, deque())
+        delayed = self._delayed.setdefault(channel, [])
+
+        # Подошедшие повторы встают в очередь по rowid, как ORDER BY rowid в NewsStorage
+        due = []
+        while delayed and delayed[0][0] <= now:
+            due.append(heapq.heappop(delayed)[1])
+        if due:
+            pending = self._pending[channel] = deque(sorted(itertools.chain(pending, due)))
+
+        claimed = []
+        while pending and len(claimed) < limit:
+            rowid = pending.popleft()
+            row = self.outbox.get(rowid)
+            if row is None or row[3] != 'pending':
+                continue
+            if row[6] > now:
+                heapq.heappush(delayed, (row[6], rowid))
+                continue
+            row[3] = 'sending'
+            row[4] = now
+            claimed.append((rowid, row[0], row[2], self.outbox_news.get((row[0], channel)), row[5]))
+        return claimed
+
+    async def finish_outbox(self, done_ids, failed_ids, deliveries=(), retries=()):
+        now = time.time()
+        for rowid, next_attempt_at in retries:
+            row = self.outbox.get(rowid)
+            if row is not None:
+                row[3] = 'pending'
+                row[4] = now
+                row[5] += 1
+                row[6] = next_attempt_at
+                heapq.heappush(self._delayed.setdefault(row[1], []), (next_attempt_at, rowid))
+
+        for status, rowids in (('done', done_ids), ('failed', failed_ids)):
+            for rowid in rowids:
+                row = self.outbox.get(rowid)
+                if row is not None:
+                    row[3] = status
+                    row[4] = now
+
+        for news_id, channel, recipient, status, attempts, first_attempt_at, delivered_at in deliveries:
+            key = (news_id, channel, recipient)
+            previous = self.deliveries.get(key)
+            if previous is not None:
+                attempts += previous[1]
+                first_attempt_at = previous[2]
+            self.deliveries[key] = [status, attempts, first_attempt_at, delivered_at]
+
+    async def reset_claimed_outbox(self):
+        count = 0
+        for rowid, row in sorted(self.outbox.items()):
+            if row[3] == 'sending':
+                row[3] = 'pending'
+                count += 1
+        # Очередь восстанавливается в исходном порядке rowid, отложенные строки
+        # claim_outbox снова уберет в кучу
+        self._delayed.clear()
+        for channel in self._pending:
+            self._pending[channel] = deque(
+                rowid for rowid, row in sorted(self.outbox.items())
+                if row[1] == channel and row[3] == 'pending'
+            )
+        if count:
+            print(f"Возвращено в очередь неотправленных сообщений: {count}")
+
+    async def prune_deliveries(self, older_than, chunk_size=500):
+        total = 0
+
+        expired = [key for key, row in self.deliveries.items() if row[2] < older_than]
+        for key in expired:
+            status, attempts, first_attempt_at, delivered_at = self.deliveries.pop(key)
+            day = datetime.fromtimestamp(first_attempt_at, timezone.utc).strftime('%Y-%m-%d')
+            stats = self.deliveries_daily.setdefault((day, key[1], status), [0, 0, 0.0])
+            stats[0] += 1
+            stats[1] += attempts
+            if delivered_at is not None:
+                stats[2] += delivered_at - first_attempt_at
+            total += 1
+
+        finished = [
+            rowid for rowid, row in self.outbox.items()
+            if row[3] in ('done', 'failed') and row[4] < older_than
+        ]
+        for rowid in finished:
+            news_id, channel, recipient = self.outbox.pop(rowid)[:3]
+            del self._outbox_keys[(news_id, channel, recipient)]
+            total += 1
+
+        alive = {(key[0], key[1]) for key in self._outbox_keys}
+        for key in [key for key in self.outbox_news if key not in alive]:
+            del self.outbox_news[key]
+
+        if total:
+            print(f"Удалено устаревших строк доставки: {total}")
+        return total
+
+    # Кэш загруженных картинок
+
+    async def get_media_file_id(self, media_key, channel):
+        return self.media_cache.get((media_key, channel))
+
+    async def save_media_file_id(self, media_key, channel, file_id):
+        self.media_cache[(media_key, channel)] = file_id
+
+    async def delete_media_file_id(self, media_key, channel, file_id):
+        if self.media_cache.get((media_key, channel)) == file_id:
+            del self.media_cache[(media_key, channel)]
+
+
+async def main():
+    # Сравнение задержек двух реализаций на одной и той же нагрузке
+    from storage import NewsStorage
+
+    async def workload(storage):
+        timings = {}
+
+        start = time.perf_counter()
+        await storage.bulk_upsert_users('tg', ((i, i, f"user{i}", 1) for i in range(1, 20001)))
+        timings['bulk_upsert_users'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        await asyncio.gather(*(storage.add_user_yx(f"login{i}") for i in range(2000)))
+        timings['add_user_yx x2000'] = time.perf_counter() - start
+
+        last_id = await storage.get_last_id("hr_portal")
+        payloads = [(f"hr_{last_id + i}", 'tg', "{}") for i in range(1, 4)]
+        start = time.perf_counter()
+        await storage.enqueue_news("hr_portal", last_id + 3, last_id, payloads)
+        timings['enqueue_news'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        claimed = 0
+        while True:
+            rows = await storage.claim_outbox('tg', 500)
+            if not rows:
+                break
+            claimed += len(rows)
+            now = time.time()
+            await storage.finish_outbox(
+                [row[0] for row in rows], [],
+                [(row[1], 'tg', row[2], 'delivered', 1, now, now) for row in rows]
+            )
+        timings['claim/finish_outbox'] = time.perf_counter() - start
+        print(f"Доставлено строк outbox: {claimed}")
+
+        return timings
+
+    async with MemoryStorage() as memory:
+        memory_timings = await workload(memory)
+    async with NewsStorage("benchmark.db") as sqlite:
+        sqlite_timings = await workload(sqlite)
+
+    print(f"{'операция':<24}{'память, с':>12}{'SQLite, с':>12}")
+    for name, value in memory_timings.items():
+        print(f"{name:<24}{value:>12.4f}{sqlite_timings[name]:>12.4f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,166 @@
+import bisect
+import functools
+import time
+
+# Метрики пишутся из одного потока event loop, поэтому обходятся без блокировок:
+# обновление - это одна операция со словарем или списком.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+
+    kind = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values = {} if labels else {(): 0}
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        for label_values, value in self.values.items():
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {value}"
+
+
+class Gauge(Counter):
+
+    kind = 'gauge'
+
+    def set(self, value, *label_values):
+        self.values[label_values] = value
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram:
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, value, *label_values):
+        state = self.values.get(label_values)
+        if state is None:
+            # счетчики по корзинам + сумма + количество
+            state = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            self.values[label_values] = state
+
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    def render(self):
+        for label_values, state in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, ('le', bound))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+
+            labels = _format_labels(self.labels, label_values, ('le', '+Inf'))
+            yield f"{self.name}_bucket{labels} {state[-1]}"
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {state[-2]}"
+            yield f"{self.name}_count{labels} {state[-1]}"
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+def timed(histogram, *label_values):
+
+    def decorator(func):
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, *label_values)
+
+        return wrapper
+
+    return decorator
+
+
+REGISTRY = MetricsRegistry()
+
+SEND_SECONDS = REGISTRY.register(Histogram(
+    'delivery_send_seconds', 'Время одной отправки сообщения', ('channel',)
+))
+SENDS_TOTAL = REGISTRY.register(Counter(
+    'delivery_sends_total', 'Результаты отправок: success, failure, retry, dead', ('channel', 'result')
+))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'delivery_queue_depth', 'Сообщения в планировщике, ожидающие отправки', ('channel',)
+))
+OUTBOX_IN_FLIGHT = REGISTRY.register(Gauge(
+    'outbox_in_flight_rows', 'Строки outbox, забранные диспетчером в доставку', ('channel',)
+))
+HR_POLL_SECONDS = REGISTRY.register(Histogram(
+    'hr_poll_seconds', 'Длительность опроса HR-портала'
+))
+HR_ITEMS_PARSED = REGISTRY.register(Counter(
+    'hr_items_parsed_total', 'Разобранные новости HR-портала'
+))
+HR_PARSE_CACHE_HITS = REGISTRY.register(Counter(
+    'hr_parse_cache_hits_total', 'Новости HR-портала, взятые из кэша разобранных'
+))
+HR_NOT_MODIFIED = REGISTRY.register(Counter(
+    'hr_poll_not_modified_total', 'Опросы HR-портала без изменений (304 или тот же ответ)'
+))
+HR_DETECTION_SECONDS = REGISTRY.register(Histogram(
+    'hr_detection_seconds', 'Задержка от публикации новости на портале до ее обнаружения',
+    buckets=(15, 30, 60, 120, 300, 600, 1800, 3600, 3 * 3600, 12 * 3600, 24 * 3600)
+))
+HR_POLL_INTERVAL = REGISTRY.register(Gauge(
+    'hr_poll_interval_seconds', 'Текущая пауза до следующего опроса HR-портала'
+))
+HR_NEW_ITEMS = REGISTRY.register(Counter(
+    'hr_new_items_total', 'Новые новости, поставленные в рассылку'
+))
+HR_PUSHED_ITEMS = REGISTRY.register(Counter(
+    'hr_pushed_items_total', 'Новые новости, пришедшие веб-хуком HR-портала'
+))
+STORAGE_QUERY_SECONDS = REGISTRY.register(Histogram(
+    'storage_query_seconds', 'Время запросов к БД', ('query',)
+))
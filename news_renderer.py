@@ -0,0 +1,38 @@
+from collections import OrderedDict
+
+# Увеличивать при любом изменении шаблонов сообщений в каналах
+TEMPLATE_VERSION = 2
+
+RUBRIC_EMOJIS = {
+    'Anniversary time': '🎉',
+    'Career upgrade': '🚀',
+    'день рождения': '🎂',
+    'Без рубрики': '📰'
+}
+
+
+class NewsRenderer:
+
+    def __init__(self, channels, max_items=256):
+        # channels - {канал: доставка с методом render_payload(news_item)}
+        self.channels = channels
+        self.max_items = max_items
+        self._cache = OrderedDict()
+
+    def render(self, news_item):
+        key = (news_item['id'], TEMPLATE_VERSION)
+        payloads = self._cache.get(key)
+
+        if payloads is not None:
+            self._cache.move_to_end(key)
+            return payloads
+
+        payloads = {
+            channel: delivery.render_payload(news_item)
+            for channel, delivery in self.channels.items()
+        }
+        self._cache[key] = payloads
+        if len(self._cache) > self.max_items:
+            self._cache.popitem(last=False)
+
+        return payloads
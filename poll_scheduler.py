@@ -0,0 +1,94 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+
+class PollScheduler:
+    # Интервал опроса источника подстраивается под активность:
+    # - после новых новостей опрос учащается до min_interval (анонсы идут пачками);
+    # - без новостей интервал растет в backoff раз до max_interval;
+    # - вне рабочего времени потолок off_hours_interval, но опрос не проспит
+    #   начало рабочего дня;
+    # - к задержке добавляется случайный разброс jitter, чтобы опросы не шли ровно по сетке.
+
+    def __init__(self, min_interval=15, max_interval=120, off_hours_interval=1800, backoff=2.0,
+                 jitter=0.1, business_hours=(9, 19), business_days=(0, 1, 2, 3, 4), utc_offset=3):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.off_hours_interval = off_hours_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.business_hours = business_hours
+        self.business_days = set(business_days)
+        # Рабочее время считается по часовому поясу портала, а не сервера
+        self.timezone = timezone(timedelta(hours=utc_offset))
+        self.interval = min_interval
+
+    @classmethod
+    def from_config(cls, config, reconcile=False):
+        # reconcile=True - новости приходят веб-хуком, опрос только редкая сверка
+        polling_config = dict(config.load_config('polling'))
+        reconcile_interval = polling_config.pop('reconcile_interval')
+        if reconcile:
+            polling_config['min_interval'] = reconcile_interval
+            polling_config['max_interval'] = reconcile_interval
+            polling_config['off_hours_interval'] = max(polling_config['off_hours_interval'], reconcile_interval)
+        return cls(**polling_config)
+
+    def now(self):
+        return datetime.now(self.timezone)
+
+    def is_business_time(self, now):
+        start, end = self.business_hours
+        return now.weekday() in self.business_days and start <= now.hour < end
+
+    def seconds_until_business_time(self, now):
+        start = self.business_hours[0]
+        day = now.replace(hour=start, minute=0, second=0, microsecond=0)
+        if day <= now:
+            day += timedelta(days=1)
+        # Ближайший рабочий день; без рабочих дней окно не откроется никогда
+        for _ in range(7):
+            if day.weekday() in self.business_days:
+                return (day - now).total_seconds()
+            day += timedelta(days=1)
+        return None
+
+    def next_delay(self, new_count, now=None):
+        now = now or self.now()
+        business = self.is_business_time(now)
+        ceiling = self.max_interval if business else self.off_hours_interval
+
+        if new_count:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, ceiling)
+
+        delay = self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+        if not business:
+            until_open = self.seconds_until_business_time(now)
+            if until_open is not None:
+                delay = min(delay, until_open)
+
+        return max(delay, 1.0)
+
+
+def main():
+    # Прогон расписания по суткам с новостями в 10:00-10:10: python poll_scheduler.py
+    scheduler = PollScheduler()
+    now = datetime(2026, 2, 11, 0, 0, tzinfo=scheduler.timezone)
+    end = now + timedelta(days=1)
+    polls_by_hour = [0] * 24
+    new_count = 0
+
+    while now < end:
+        polls_by_hour[now.hour] += 1
+        now += timedelta(seconds=scheduler.next_delay(new_count, now))
+        new_count = 1 if now.hour == 10 and now.minute < 10 else 0
+
+    for hour, polls in enumerate(polls_by_hour):
+        print(f"{hour:02d}:00 опросов: {polls}")
+    print(f"Опросов за сутки: {sum(polls_by_hour)} (при фиксированных 60 с: {24 * 60})")
+
+
+if __name__ == "__main__":
+    main()
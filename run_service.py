@@ -1,5 +1,6 @@
 import asyncio
 from storage import NewsStorage
+from memory_storage import MemoryStorage
 from hr_portal_adapter import HRPortalAdapter
 from dispatcher import Dispatcher
 from config_loader import Config
@@ -7,6 +8,20 @@ from telegram_delivery import TelegramDelivery
 from telegram_bot import NewsBot
 from yandex_delivery import YandexBotConfig, YandexDeliveryBot
 from webhook_server import WebhookServer
+from http_client import HttpClient
+from snapshot_archive import SnapshotArchive
+from poll_scheduler import PollScheduler
+
+def create_storage(config):
+    # STORAGE_BACKEND=memory - без диска, для нагрузочных прогонов
+    storage_config = config.load_config('storage')
+    if storage_config['backend'] == 'memory':
+        return MemoryStorage()
+    return NewsStorage(storage_config['db_name'])
+
+def create_snapshot_archive(config):
+    snapshot_dir = config.load_config('hr_portal')['snapshot_dir']
+    return SnapshotArchive(snapshot_dir) if snapshot_dir else None
 
 async def run_all():
 
@@ -14,11 +29,15 @@ async def run_all():
 
     config = Config()
 
-    async with NewsStorage() as storage:
+    async with create_storage(config) as storage, HttpClient.from_config(config) as http_client:
+
+        # Строки, забранные в отправку до падения прошлого запуска, возвращаются в очередь
+        await storage.reset_claimed_outbox()
 
         news_bot = NewsBot(
             token=config.load_config('telegram')['bot_token'],
-            storage=storage
+            storage=storage,
+            http_client=http_client
         )
 
         bot_task = asyncio.create_task(news_bot.run())
@@ -28,29 +47,41 @@ async def run_all():
         api_url = config.load_config('hr_portal')['api_url'],
         username = config.load_config('hr_portal')['username'],
         password = config.load_config('hr_portal')['password'],
-        api_token = config.load_config('hr_portal')['api_token']) as hr_adapter:
+        api_token = config.load_config('hr_portal')['api_token'],
+        http_client = http_client,
+        snapshot_archive = create_snapshot_archive(config),
+        session_file = config.load_config('hr_portal')['session_file'],
+        utc_offset = config.load_config('hr_portal')['utc_offset'],
+        catchup_max_pages = config.load_config('hr_portal')['catchup_max_pages']) as hr_adapter:
 
             telegram = TelegramDelivery(
                 bot_token=config.load_config('telegram')['bot_token'],
-                default_chat_id = config.load_config('telegram')['chat_id']
+                default_chat_id = config.load_config('telegram')['chat_id'],
+                storage = storage,
+                image_loader = hr_adapter.download_image,
+                http_client = http_client
             )
 
                 
             yx_bot_config = YandexBotConfig.from_config(config)
-            yx_bot = YandexDeliveryBot(yx_bot_config, storage)
+            yx_bot = YandexDeliveryBot(yx_bot_config, storage, telegram, http_client=http_client)
             webhook = await yx_bot.set_webhook(config.load_config('server')['base_url'])
 
-            server = WebhookServer(yx_bot, "0.0.0.0", 8080)
-            await server.start()
+            hr_webhook_secret = config.load_config('hr_portal')['webhook_secret']
 
             dispatcher = Dispatcher(
                 adapter= hr_adapter,
                 storage = storage,
                 telegram= telegram,
                 yandex=yx_bot,
-                check_interval=60
+                check_interval=60,
+                scheduler=PollScheduler.from_config(config, reconcile=bool(hr_webhook_secret))
             )
 
+            server = WebhookServer(yx_bot, "0.0.0.0", 8080,
+                                   dispatcher=dispatcher, hr_webhook_secret=hr_webhook_secret)
+            await server.start()
+
             try:
                 await dispatcher.run_forever()
             finally:
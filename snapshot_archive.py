@@ -0,0 +1,91 @@
+import asyncio
+import gzip
+import json
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+
+
+class SnapshotArchive:
+    # Архив сырых ответов HR-портала для отладки и замеров. Включается явно:
+    # адаптер сохраняет сюда только изменившиеся ответы, запись и ротация
+    # выполняются в отдельном потоке, чтобы не блокировать event loop.
+
+    def __init__(self, archive_dir="data/snapshots", max_files=500, max_bytes=50 * 1024 * 1024):
+        self.archive_dir = Path(archive_dir)
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+
+    async def save(self, body: bytes):
+        name = datetime.now().strftime("hr_%Y%m%d_%H%M%S_%f.json.gz")
+        path = self.archive_dir / name
+        await asyncio.to_thread(self._write, path, body)
+        await asyncio.to_thread(self._rotate)
+        return path
+
+    def _write(self, path, body):
+        tmp_path = path.with_suffix(path.suffix + '.tmp')
+        try:
+            with gzip.open(tmp_path, 'wb') as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+        except OSError:
+            # Недописанный файл не остается занимать место
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+    def _rotate(self):
+        # Удаляются самые старые снимки сверх лимита по количеству или объему
+        snapshots = self.snapshots()
+        sizes = [path.stat().st_size for path in snapshots]
+        total = sum(sizes)
+        count = len(snapshots)
+
+        for path, size in zip(snapshots, sizes):
+            if count <= self.max_files and total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            count -= 1
+            total -= size
+            print(f"Снимок удален из архива: {path.name}")
+
+    def snapshots(self):
+        # Имена начинаются с времени, поэтому сортировка по имени - хронологическая
+        return sorted(self.archive_dir.glob("hr_*.json.gz"))
+
+    @staticmethod
+    def load(path):
+        with gzip.open(path, 'rb') as f:
+            return json.loads(f.read())
+
+    def replay(self):
+        # Снимки по порядку: (путь, разобранный JSON ответа портала)
+        for path in self.snapshots():
+            yield path, self.load(path)
+
+
+def main():
+    # Прогон разбора по архиву: python snapshot_archive.py [каталог]
+    import sys
+    from hr_portal_adapter import HRPortalAdapter
+
+    archive = SnapshotArchive(sys.argv[1] if len(sys.argv) > 1 else "data/snapshots")
+    adapter = HRPortalAdapter("", "", "", "", api_token="replay")
+
+    snapshots = 0
+    items = 0
+    start = time.perf_counter()
+    for path, data in archive.replay():
+        parsed = adapter._parse_items(data['data']['items'])
+        snapshots += 1
+        items += len(parsed)
+        print(f"{path.name}: новостей {len(parsed)}, последняя {parsed[0]['id'] if parsed else '-'}")
+
+    elapsed = time.perf_counter() - start
+    print(f"Снимков: {snapshots}, новостей: {items}, время разбора: {elapsed:.3f} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,233 @@
 import aiosqlite
 import asyncio
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import os
 import pathlib 
 from pathlib import Path
+from metrics import STORAGE_QUERY_SECONDS, timed
+from subscriber_registry import SubscriberRegistry
+from base_storage import BaseStorage, SUBSCRIBER_COLUMNS
 
-class NewsStorage:
+OUTBOX_FAN_OUT = {
+    'tg': '''
+    INSERT OR IGNORE INTO outbox (news_id, channel, recipient)
+    SELECT ?, 'tg', CAST(chat_id AS TEXT) FROM users_tg WHERE is_active = 1
+    ''',
+    'yx': '''
+    INSERT OR IGNORE INTO outbox (news_id, channel, recipient)
+    SELECT ?, 'yx', login FROM users_yx WHERE is_active = 1
+    '''
+}
 
-    def __init__(self, db_name = "news.db"):
+# Частые запросы - постоянные строки, чтобы попадать в кэш подготовленных выражений
+SQL_GET_LAST_ID = "SELECT last_id FROM source_cursors WHERE source = ?"
+
+SQL_GET_MEDIA_FILE_ID = "SELECT file_id FROM media_cache WHERE media_key = ? AND channel = ?"
+
+SUBSCRIBER_TABLES = {'tg': 'users_tg', 'yx': 'users_yx'}
+
+
+class NewsStorage(BaseStorage):
+
+    def __init__(self, db_name = "news.db", commit_delay=0.002, max_batch=256, readers=4,
+                 cached_statements=128, subscribers_check_interval=1.0):
 
         data_dir = Path("data")
         data_dir.mkdir(exist_ok=True)
         self.db_path = str(data_dir/db_name)
-        self.connection = None
+        self.readers = []
+        self._idle_readers = []
+        self._reader_waiters = deque()
+        self.reader_count = readers
+        self.cached_statements = cached_statements
+        self.writer = None
         self.db_name = db_name
+        self.commit_delay = commit_delay
+        self.max_batch = max_batch
+        self._write_queue = None
+        self._writer_task = None
+        self._writer_thread = None
+        self.subscribers = SubscriberRegistry()
+        # Подписчиков может изменить другой процесс (manage_users.py). PRAGMA data_version
+        # соединения-писателя меняется только от чужих коммитов - по ней копию в памяти
+        # перечитывает фоновая задача раз в subscribers_check_interval секунд.
+        # Проверки команд читают только память и не ждут писателя.
+        self.subscribers_check_interval = subscribers_check_interval
+        self._data_version = None
+        self._subscribers_task = None
 
 
     async def connect(self):
-        if self.connection is None:
-            self.connection = await aiosqlite.connect(self.db_path)
-            await self._create_table()
-            await self.initialize_last_id("hr_portal", "hr_0")
+        if not self.readers:
+            # Все изменения идут через одно соединение-писатель в режиме WAL в своем потоке,
+            # чтение - через небольшой пул соединений только для чтения, каждое в своем
+            # потоке: запросы не ждут ни записи, ни друг друга
+            self._writer_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+            self.writer = await self._in_writer_thread(self._open_writer)
+
+            self._write_queue = asyncio.Queue()
+            self._writer_task = asyncio.create_task(self._writer_loop())
+
+            await self._write(self._create_table)
+            await self.initialize_last_id("hr_portal", 0)
+
+            for _ in range(self.reader_count):
+                reader = await aiosqlite.connect(self.db_path, cached_statements=self.cached_statements)
+                await reader.execute("PRAGMA query_only = 1")
+                self.readers.append(reader)
+                self._idle_readers.append(reader)
+            self._data_version = await self._in_writer_thread(self._read_data_version)
+            self.subscribers.load(*await self._write(self._read_subscribers))
+            self._subscribers_task = asyncio.create_task(self._watch_subscribers())
             print("Подключение к БД выполнено")
 
-    async def _create_table(self):
+    def _read_subscribers(self, db):
+        # Дальше активные подписчики и проверки команд читаются из памяти, а не из БД.
+        # Читается через писателя, чтобы снимок совпадал с очередностью записей.
+        return (
+            db.execute("SELECT user_id, chat_id, is_active FROM users_tg").fetchall(),
+            db.execute("SELECT login, is_active FROM users_yx").fetchall(),
+            db.execute("SELECT tg_id, yx_id FROM user_tg_yx ORDER BY rowid").fetchall()
+        )
+
+    def _read_data_version(self):
+        return self.writer.execute("PRAGMA data_version").fetchone()[0]
+
+    async def _refresh_subscribers(self):
+        version = await self._in_writer_thread(self._read_data_version)
+        if version != self._data_version:
+            self._data_version = version
+            self.subscribers.load(*await self._write(self._read_subscribers))
+
+    async def _watch_subscribers(self):
+        while True:
+            await asyncio.sleep(self.subscribers_check_interval)
+            try:
+                await self._refresh_subscribers()
+            except Exception as ex:
+                print("Ошибка обновления подписчиков: ", ex)
+
+    async def _acquire_reader(self):
+        if self._idle_readers:
+            return self._idle_readers.pop()
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._reader_waiters.append(waiter)
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release_reader(waiter.result())
+            raise
+
+    def _release_reader(self, reader):
+        # Соединение передается сразу самому давнему ожидающему, иначе
+        # освободивший его цикл запросов забирал бы его снова и остальные бы голодали
+        while self._reader_waiters:
+            waiter = self._reader_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(reader)
+                return
+        self._idle_readers.append(reader)
+
+    async def _fetch(self, sql, params=(), one=False):
+        # Свободное соединение из пула; запрос подготавливается один раз
+        # и дальше берется из кэша выражений этого соединения
+        reader = await self._acquire_reader()
+        try:
+            async with reader.execute(sql, params) as cursor:
+                if one:
+                    return await cursor.fetchone()
+                return await cursor.fetchall()
+        finally:
+            self._release_reader(reader)
+
+    def _open_writer(self):
+        db = sqlite3.connect(
+            self.db_path, isolation_level=None, check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    async def _in_writer_thread(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._writer_thread, func, *args)
+
+    async def _writer_loop(self):
+        while True:
+            batch = [await self._write_queue.get()]
+            if batch[0] is None:
+                return
+
+            # Небольшая пауза, чтобы собрать записи других вызывающих в ту же транзакцию
+            if self._write_queue.empty():
+                await asyncio.sleep(self.commit_delay)
+
+            stop = False
+            while len(batch) < self.max_batch and not self._write_queue.empty():
+                item = self._write_queue.get_nowait()
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
 
-        await self.connection.execute('''
+            try:
+                outcomes = await self._in_writer_thread(
+                    self._apply_batch, [operation for operation, _ in batch]
+                )
+            except Exception as ex:
+                print("Ошибка записи в БД: ", ex)
+                outcomes = [(None, ex)] * len(batch)
+
+            for (_, future), (result, error) in zip(batch, outcomes):
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+            if stop:
+                return
+
+    def _apply_batch(self, operations):
+        # Вся пачка - одна транзакция и один переход в поток писателя.
+        # Ошибка одной операции откатывает только ее, а не всю пачку.
+        db = self.writer
+        outcomes = []
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for operation in operations:
+                db.execute("SAVEPOINT write_op")
+                try:
+                    outcomes.append((operation(db), None))
+                except Exception as ex:
+                    db.execute("ROLLBACK TO write_op")
+                    outcomes.append((None, ex))
+                db.execute("RELEASE write_op")
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return outcomes
+
+    async def _write(self, operation):
+        # operation(db) - синхронная функция, писатель выполняет ее внутри общей транзакции
+        future = asyncio.get_running_loop().create_future()
+        self._write_queue.put_nowait((operation, future))
+        return await future
+
+    async def _execute_write(self, sql, params=()):
+        return await self._write(lambda db: db.execute(sql, params).rowcount)
+
+    def _create_table(self, db):
+
+        db.execute('''
         CREATE TABLE IF NOT EXISTS sent_news (
             id TEXT PRIMARY KEY,
             source TEXT NOT NULL,
@@ -34,7 +236,21 @@ class NewsStorage:
         ''')
         print("В базе данных создана таблица sent_news")
 
-        await self.connection.execute('''
+        db.execute('''
+        CREATE TABLE IF NOT EXISTS source_cursors (
+            source TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL DEFAULT 0
+        )
+        ''')
+        # Перенос курсоров из sent_news: числовой максимум вместо строкового 'hr_99' > 'hr_280'
+        db.execute('''
+        INSERT OR IGNORE INTO source_cursors (source, last_id)
+        SELECT source, MAX(CAST(substr(id, instr(id, '_') + 1) AS INTEGER))
+        FROM sent_news GROUP BY source
+        ''')
+        print("В базе данных создана таблица source_cursors")
+
+        db.execute('''
         CREATE TABLE IF NOT EXISTS users_tg (
             user_id INTEGER PRIMARY KEY,
             chat_id INTEGER UNIQUE NOT NULL,
@@ -43,7 +259,7 @@ class NewsStorage:
         ''')
         print("В базе данных создана таблица users_tg")
 
-        await self.connection.execute('''
+        db.execute('''
         CREATE TABLE IF NOT EXISTS users_yx (
             login TEXT PRIMARY KEY,
             is_active BOOLEAN DEFAULT 1
@@ -51,7 +267,7 @@ class NewsStorage:
         ''')
         print("В базе данных создана таблица users_yx")
 
-        await self.connection.execute('''
+        db.execute('''
         CREATE TABLE IF NOT EXISTS user_tg_yx (
         tg_id INTEGER,
         yx_id TEXT,
@@ -61,211 +277,535 @@ class NewsStorage:
         )
         ''')
 
-        await self.connection.commit()
+        db.execute('''
+        CREATE TABLE IF NOT EXISTS outbox_news (
+            news_id TEXT NOT NULL,
+            channel TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            PRIMARY KEY (news_id, channel)
+        )
+        ''')
+
+        db.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            news_id TEXT NOT NULL,
+            channel TEXT NOT NULL,
+            recipient TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (news_id, channel, recipient)
+        )
+        ''')
+        db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox (channel, status)
+        ''')
+        # Для очистки по сроку хранения: завершенные строки берутся по индексу, без обхода таблицы
+        db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_outbox_status_updated ON outbox (status, updated_at)
+        ''')
+        print("В базе данных создана таблица outbox")
+
+        # Журнал доставки: время в секундах unix, чтобы задержку считать вычитанием
+        db.execute('''
+        CREATE TABLE IF NOT EXISTS deliveries (
+            news_id TEXT NOT NULL,
+            channel TEXT NOT NULL,
+            recipient TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            first_attempt_at REAL NOT NULL,
+            delivered_at REAL,
+            PRIMARY KEY (news_id, channel, recipient)
+        )
+        ''')
+        db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_deliveries_first_attempt ON deliveries (first_attempt_at)
+        ''')
+        print("В базе данных создана таблица deliveries")
+
+        # Сводка по дням для строк журнала, удаленных по сроку хранения
+        db.execute('''
+        CREATE TABLE IF NOT EXISTS deliveries_daily (
+            day TEXT NOT NULL,
+            channel TEXT NOT NULL,
+            status TEXT NOT NULL,
+            deliveries INTEGER NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            latency_sum REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, channel, status)
+        )
+        ''')
+        print("В базе данных создана таблица deliveries_daily")
+
+        db.execute('''
+        CREATE TABLE IF NOT EXISTS media_cache (
+            media_key TEXT NOT NULL,
+            channel TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (media_key, channel)
+        )
+        ''')
+        print("В базе данных создана таблица media_cache")
+
+        for table in ('users_tg', 'users_yx'):
+            self._add_column(db, table, 'deactivated_reason', 'TEXT')
+            self._add_column(db, table, 'deactivated_at', 'TIMESTAMP')
+
+        # Повторы после временных ошибок: строка остается 'pending' до next_attempt_at
+        self._add_column(db, 'outbox', 'attempts', 'INTEGER NOT NULL DEFAULT 0')
+        self._add_column(db, 'outbox', 'next_attempt_at', 'REAL NOT NULL DEFAULT 0')
+
+    def _add_column(self, db, table, column, column_type):
+        columns = [row[1] for row in db.execute(f"PRAGMA table_info({table})")]
+
+        if column not in columns:
+            db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+            print(f"В таблицу {table} добавлен столбец {column}")
     
-    async def initialize_last_id(self, source_code, default_id):
-        async with self.connection.execute(
-            "SELECT COUNT(*) FROM sent_news WHERE source = ?", (source_code,)
-        ) as cursor:
-            count = (await cursor.fetchone())[0]
-            if count == 0:
-                await self.connection.execute(
-                    "INSERT INTO sent_news (id, source) VALUES (?, ?)",
-                    (default_id, source_code)
-                )
-                await self.connection.commit()
+    async def initialize_last_id(self, source_code, default_id=0):
+        await self._execute_write(
+            "INSERT OR IGNORE INTO source_cursors (source, last_id) VALUES (?, ?)",
+            (source_code, default_id)
+        )
 
+    @timed(STORAGE_QUERY_SECONDS, 'link_accounts')
     async def link_accounts(self, tg_id, yx_id):
-        await self.connection.execute('''
+        await self._execute_write('''
         INSERT INTO user_tg_yx(tg_id, yx_id)
         VALUES (?, ?)
         ''', (tg_id, yx_id))
-        await self.connection.commit()
+        self.subscribers.link(tg_id, yx_id)
     
     async def get_tg_id_by_yx(self, yx_id):
-        async with self.connection.execute('''
-            SELECT tg_id FROM user_tg_yx WHERE yx_id = ?
-        ''', (yx_id,)) as cursor:
-            row = await cursor.fetchone()
-            return row[0] if row else None
+        return self.subscribers.tg_id_by_yx(yx_id)
 
+    @timed(STORAGE_QUERY_SECONDS, 'add_user_yx')
     async def add_user_yx(self, login):
         try:
-            await self.connection.execute('''
+            await self._execute_write('''
             INSERT OR REPLACE INTO users_yx
             (login, is_active)
             VALUES(?, 1)
             ''', (login,))
-
-            await self.connection.commit()
+            self.subscribers.put_yx(login)
         
         except Exception as ex:
             print("Ошибка добавления пользователя: ", ex)
             return False 
     
     async def get_all_activate_users_yx(self):
-        try:
-            async with self.connection.execute('''
-                SELECT login from users_yx WHERE is_active = 1
-            ''') as cursor:
-                results = await cursor.fetchall()
-                return [row[0] for row in results] if results else []
-        except Exception as ex:
-            print("Ошибка получения logins", ex)
+        return self.subscribers.active_logins()
+
+    async def iter_active_users_yx(self, chunk_size=1000):
+        async for chunk in self._iter_keyset('users_yx', 'login', ('login',), chunk_size, True):
+            yield [row[0] for row in chunk]
 
+    @timed(STORAGE_QUERY_SECONDS, 'subscribe_user_yx')
     async def subscribe_user_yx(self, login):
             try:
-                await self.connection.execute(
-                    "UPDATE users_yx SET is_active = 1 WHERE login = ?", (login,)
+                await self._execute_write(
+                    "UPDATE users_yx SET is_active = 1, deactivated_reason = NULL WHERE login = ?", (login,)
                 )
-                await self.connection.commit()
+                self.subscribers.set_active_yx(login, True)
                 return True
             except Exception as ex:
                 print("Ошибка подпсики: ", ex)
                 return False
     
+    @timed(STORAGE_QUERY_SECONDS, 'unsubscribe_user_yx')
     async def unsubscribe_user_yx(self, login):
 
         try:
-            await self.connection.execute(
+            await self._execute_write(
                 "UPDATE users_yx SET is_active = 0 WHERE login = ?",
                 (login,)
             )
-            await self.connection.commit()
+            self.subscribers.set_active_yx(login, False)
             return True
         except Exception as e:
             return False
     
     async def check_active_yx(self, login):
-        try:
-            async with self.connection.execute('''
-            SELECT is_active FROM users_yx WHERE login = ?
-            ''', (login, )) as cursor:
-
-                result = await cursor.fetchone()
-                if result:
-                    return True if result[0] == 1 else False
-                else: return False
-        except Exception as ex:
-            print("Ошибка проверки: ", ex)
-            return False
+        return self.subscribers.is_active_yx(login)
     
     async def check_exist_yx_login(self, login):
-        try:
-            async with self.connection.execute('''
-            SELECT is_active FROM users_yx WHERE login = ?
-            ''', (login, )) as cursor:
-
-                result = await cursor.fetchone()
-                if result:
-                    return True 
-                else: return False
-        except Exception as ex:
-            print("Ошибка проверки: ", ex)
-            return False
+        return self.subscribers.has_yx(login)
 
 
 
+    @timed(STORAGE_QUERY_SECONDS, 'add_user_tg')
     async def add_user_tg(self, user_id, chat_id, user_name):
         try:
-            await self.connection.execute('''
+            await self._execute_write('''
             INSERT OR REPLACE INTO users_tg
             (user_id, chat_id, user_name, is_active)
             VALUES (?, ?, ?, 1)
             ''', (user_id, chat_id, user_name))
-
-            await self.connection.commit()
+            self.subscribers.put_tg(user_id, chat_id)
         except Exception as ex:
             print("Ошибка добавления пользователя: ", ex)
             return False
 
     async def get_all_activate_users_tg(self):
+        return self.subscribers.active_chat_ids()
+
+    async def iter_active_users_tg(self, chunk_size=1000):
+        async for chunk in self._iter_keyset('users_tg', 'chat_id', ('chat_id',), chunk_size, True):
+            yield [row[0] for row in chunk]
+
+    async def _iter_keyset(self, table, key, columns, chunk_size, active_only=False):
+        # Пагинация по ключу (key > последнего выданного) по уникальному индексу:
+        # каждая страница - короткий запрос, в памяти не больше одной пачки.
+        # key должен быть первым в columns.
+        conditions = ["is_active = 1"] if active_only else []
+        after = None
+        while True:
+            where = conditions + ([f"{key} > ?"] if after is not None else [])
+            sql = f"SELECT {', '.join(columns)} FROM {table}"
+            if where:
+                sql += " WHERE " + " AND ".join(where)
+            sql += f" ORDER BY {key} LIMIT ?"
+            params = (after, chunk_size) if after is not None else (chunk_size,)
+
+            rows = await self._fetch(sql, params)
+
+            if not rows:
+                return
+            yield rows
+            if len(rows) < chunk_size:
+                return
+            after = rows[-1][0]
+
+    @timed(STORAGE_QUERY_SECONDS, 'bulk_upsert_users')
+    async def bulk_upsert_users(self, channel, rows):
+        # rows - итерируемое кортежей в порядке SUBSCRIBER_COLUMNS[channel].
+        # Весь импорт - один executemany в одной транзакции писателя; rows читается
+        # уже в потоке писателя, поэтому может лениво читать файл.
+        # Чтение подписчиков из соединения-читателя при этом не блокируется.
+        columns = SUBSCRIBER_COLUMNS[channel]
+        sql = f'''
+        INSERT OR REPLACE INTO {SUBSCRIBER_TABLES[channel]} ({', '.join(columns)})
+        VALUES ({', '.join('?' * len(columns))})
+        '''
+
+        def operation(db):
+            count = db.executemany(sql, rows).rowcount
+            return count, self._read_subscribers(db)
 
         try:
-            async with self.connection.execute('''
-                SELECT chat_id from users_tg WHERE is_active = 1
-            ''') as cursor:
-                
-                results = await cursor.fetchall()
-                return [row[0] for row in results] if results else []
+            count, snapshot = await self._write(operation)
         except Exception as ex:
-            print("Ошибка получения chat_id", ex)
+            print("Ошибка импорта пользователей: ", ex)
+            return 0
+
+        self.subscribers.load(*snapshot)
+        print(f"Импортировано пользователей {channel}: {count}")
+        return count
+
+    async def export_users(self, channel, chunk_size=1000):
+        # Пачки кортежей в порядке SUBSCRIBER_COLUMNS[channel]
+        columns = SUBSCRIBER_COLUMNS[channel]
+        async for chunk in self._iter_keyset(SUBSCRIBER_TABLES[channel], columns[0], columns, chunk_size):
+            yield chunk
     
+    @timed(STORAGE_QUERY_SECONDS, 'subscribe_user_tg')
     async def subscribe_user_tg(self, user_id):
         try:
-            await self.connection.execute(
-                "UPDATE users_tg SET is_active = 1 WHERE user_id = ?", (user_id,)
+            await self._execute_write(
+                "UPDATE users_tg SET is_active = 1, deactivated_reason = NULL WHERE user_id = ?", (user_id,)
             )
-            await self.connection.commit()
+            self.subscribers.set_active_tg(user_id, True)
             return True
         except Exception as ex:
             print("Ошибка подпсики: ", ex)
             return False
     
+    @timed(STORAGE_QUERY_SECONDS, 'unsubscribe_user_tg')
     async def unsubscribe_user_tg(self, user_id):
 
         try:
-            await self.connection.execute(
+            await self._execute_write(
                 "UPDATE users_tg SET is_active = 0 WHERE user_id = ?",
                 (user_id,)
             )
-            await self.connection.commit()
+            self.subscribers.set_active_tg(user_id, False)
             return True
         except Exception as e:
             return False
     
     async def check_active_tg(self, user_id):
-        try:
-            async with self.connection.execute('''
-            SELECT is_active FROM users_tg WHERE user_id = ?
-            ''', (user_id, )) as cursor:
-
-                result = await cursor.fetchone()
-                if result:
-                    return True if result[0] == 1 else False
-                else: return False
-        except Exception as ex:
-            print("Ошибка проверки: ", ex)
-            return False
+        return self.subscribers.is_active_tg(user_id)
     
+    @timed(STORAGE_QUERY_SECONDS, 'get_last_id')
     async def get_last_id(self, source_code):
         try:
-            async with self.connection.execute(
-                "SELECT MAX(id) FROM sent_news  WHERE source = ?", (source_code,)
-            ) as cursor:
-
-                result = await cursor.fetchone()
-                return result[0] if result else None
+            result = await self._fetch(SQL_GET_LAST_ID, (source_code,), one=True)
+            return result[0] if result else None
 
         except Exception as ex:
             print("Ошибка получения id: ", ex)
 
+    @timed(STORAGE_QUERY_SECONDS, 'update_id')
     async def update_id(self, source_code, new_id, last_id):
         try:
-            await self.connection.execute(
-                """UPDATE sent_news SET id = ?
-                   WHERE id = ? AND source = ?
-            """, (new_id, last_id, source_code)
-            )
-            await self.connection.commit()
+            await self._write(lambda db: self._advance_cursor(db, source_code, new_id, last_id))
             print(f"Обновлен last_id для {source_code}: {new_id}")
         except Exception as ex:
             print("Ошибка обновления id: ", ex)
 
+    def _advance_cursor(self, db, source_code, new_id, last_id):
+        # Курсор сдвигается, только если его никто не сдвинул после чтения last_id,
+        # иначе вся операция откатывается
+        updated = db.execute(
+            "UPDATE source_cursors SET last_id = ? WHERE source = ? AND last_id = ?",
+            (new_id, source_code, last_id)
+        ).rowcount
+        if not updated:
+            raise ValueError(f"Курсор {source_code} уже изменен, ожидался {last_id}")
+
+    @timed(STORAGE_QUERY_SECONDS, 'enqueue_news')
+    async def enqueue_news(self, source_code, new_id, last_id, payloads):
+        # payloads - список (news_id, channel, text). Получатели берутся из таблиц
+        # подписчиков прямо в SQL, список аудитории в Python не собирается.
+        def operation(db):
+            db.executemany('''
+            INSERT OR REPLACE INTO outbox_news (news_id, channel, payload)
+            VALUES (?, ?, ?)
+            ''', payloads)
+
+            for news_id, channel, _ in payloads:
+                db.execute(OUTBOX_FAN_OUT[channel], (news_id,))
+
+            self._advance_cursor(db, source_code, new_id, last_id)
 
-    async def close(self):
-        if self.connection:
-            await self.connection.close()
-            print("Соединение с БД закрыто")
-    
+        try:
+            await self._write(operation)
+            print(f"Обновлен last_id для {source_code}: {new_id}")
+            return True
+        except Exception as ex:
+            print("Ошибка постановки в очередь: ", ex)
+            return False
 
+    @timed(STORAGE_QUERY_SECONDS, 'claim_outbox')
+    async def claim_outbox(self, channel, limit):
+        # Выборка и пометка 'sending' в одной транзакции писателя.
+        # Строки, отложенные после временной ошибки, ждут своего next_attempt_at.
+        def operation(db):
+            claimed = db.execute('''
+                SELECT rowid, news_id, recipient, attempts FROM outbox
+                WHERE channel = ? AND status = 'pending' AND next_attempt_at <= ?
+                ORDER BY rowid
+                LIMIT ?
+            ''', (channel, time.time(), limit)).fetchall()
+
+            if not claimed:
+                return []
+
+            # Один объект payload на новость, а не копия на каждого получателя
+            news_ids = list({row[1] for row in claimed})
+            payloads = dict(db.execute(f'''
+                SELECT news_id, payload FROM outbox_news
+                WHERE channel = ? AND news_id IN ({','.join('?' * len(news_ids))})
+            ''', (channel, *news_ids)).fetchall())
+
+            db.executemany(
+                "UPDATE outbox SET status = 'sending', updated_at = CURRENT_TIMESTAMP WHERE rowid = ?",
+                ((row[0],) for row in claimed)
+            )
 
-    async def __aenter__(self):
-        await self.connect()
-        return self
-    
-    async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self.close()
+            return [
+                (rowid, news_id, recipient, payloads.get(news_id), attempts)
+                for rowid, news_id, recipient, attempts in claimed
+            ]
+
+        try:
+            return await self._write(operation)
+        except Exception as ex:
+            print("Ошибка выборки из outbox: ", ex)
+            return []
+
+    @timed(STORAGE_QUERY_SECONDS, 'finish_outbox')
+    async def finish_outbox(self, done_ids, failed_ids, deliveries=(), retries=()):
+        # deliveries - строки журнала (news_id, channel, recipient, status, attempts,
+        # first_attempt_at, delivered_at), пишутся той же транзакцией.
+        # retries - пары (rowid, next_attempt_at): строка возвращается в очередь
+        def operation(db):
+            db.executemany('''
+            UPDATE outbox SET status = 'pending', attempts = attempts + 1, next_attempt_at = ?,
+                              updated_at = CURRENT_TIMESTAMP
+            WHERE rowid = ?
+            ''', ((next_attempt_at, rowid) for rowid, next_attempt_at in retries))
+            db.executemany(
+                "UPDATE outbox SET status = 'done', updated_at = CURRENT_TIMESTAMP WHERE rowid = ?",
+                ((rowid,) for rowid in done_ids)
+            )
+            db.executemany(
+                "UPDATE outbox SET status = 'failed', updated_at = CURRENT_TIMESTAMP WHERE rowid = ?",
+                ((rowid,) for rowid in failed_ids)
+            )
+            db.executemany('''
+            INSERT INTO deliveries (news_id, channel, recipient, status, attempts,
+                                    first_attempt_at, delivered_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (news_id, channel, recipient) DO UPDATE SET
+                status = excluded.status,
+                attempts = deliveries.attempts + excluded.attempts,
+                delivered_at = excluded.delivered_at
+            ''', deliveries)
+
+        # Ошибка не глотается: без записи строки так и остались бы 'sending'
+        await self._write(operation)
+
+    @timed(STORAGE_QUERY_SECONDS, 'prune_deliveries')
+    async def prune_deliveries(self, older_than, chunk_size=500):
+        # Строки журнала старше older_than (unix-время) сворачиваются в deliveries_daily
+        # и удаляются, вместе с завершенными строками outbox. Каждая пачка - отдельная
+        # короткая запись, между ними проходят записи доставки.
+        def operation(db):
+            db.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS prune_ids (id INTEGER PRIMARY KEY)
+            ''')
+            db.execute("DELETE FROM prune_ids")
+            db.execute('''
+            INSERT INTO prune_ids
+            SELECT rowid FROM deliveries WHERE first_attempt_at < ?
+            ORDER BY first_attempt_at LIMIT ?
+            ''', (older_than, chunk_size))
+
+            db.execute('''
+            INSERT INTO deliveries_daily (day, channel, status, deliveries, attempts, latency_sum)
+            SELECT date(first_attempt_at, 'unixepoch'), channel, status, COUNT(*), SUM(attempts),
+                   TOTAL(delivered_at - first_attempt_at)
+            FROM deliveries WHERE rowid IN (SELECT id FROM prune_ids)
+            GROUP BY 1, 2, 3
+            ON CONFLICT (day, channel, status) DO UPDATE SET
+                deliveries = deliveries_daily.deliveries + excluded.deliveries,
+                attempts = deliveries_daily.attempts + excluded.attempts,
+                latency_sum = deliveries_daily.latency_sum + excluded.latency_sum
+            ''')
+            pruned = db.execute(
+                "DELETE FROM deliveries WHERE rowid IN (SELECT id FROM prune_ids)"
+            ).rowcount
+
+            pruned += db.execute('''
+            DELETE FROM outbox WHERE rowid IN (
+                SELECT rowid FROM outbox
+                WHERE status IN ('done', 'failed') AND updated_at < datetime(?, 'unixepoch')
+                LIMIT ?
+            )
+            ''', (older_than, chunk_size)).rowcount
+            return pruned
+
+        total = 0
+        try:
+            while True:
+                pruned = await self._write(operation)
+                total += pruned
+                if not pruned:
+                    break
+
+            await self._execute_write('''
+            DELETE FROM outbox_news WHERE NOT EXISTS (
+                SELECT 1 FROM outbox
+                WHERE outbox.news_id = outbox_news.news_id AND outbox.channel = outbox_news.channel
+            )
+            ''')
+        except Exception as ex:
+            print("Ошибка очистки журнала доставки: ", ex)
+
+        if total:
+            print(f"Удалено устаревших строк доставки: {total}")
+        return total
+
+    async def reset_claimed_outbox(self):
+        count = await self._execute_write(
+            "UPDATE outbox SET status = 'pending' WHERE status = 'sending'"
+        )
+        if count:
+            print(f"Возвращено в очередь неотправленных сообщений: {count}")
+
+    @timed(STORAGE_QUERY_SECONDS, 'deactivate_recipients')
+    async def deactivate_recipients(self, channel, failures):
+        # failures - список (получатель, причина) после постоянных ошибок доставки
+        queries = {
+            'tg': '''UPDATE users_tg SET is_active = 0, deactivated_reason = ?,
+                     deactivated_at = CURRENT_TIMESTAMP WHERE chat_id = ?''',
+            'yx': '''UPDATE users_yx SET is_active = 0, deactivated_reason = ?,
+                     deactivated_at = CURRENT_TIMESTAMP WHERE login = ?'''
+        }
+
+        def operation(db):
+            db.executemany(
+                queries[channel],
+                ((reason, recipient) for recipient, reason in failures)
+            )
+            db.executemany('''
+                UPDATE outbox SET status = 'failed', updated_at = CURRENT_TIMESTAMP
+                WHERE channel = ? AND recipient = ? AND status = 'pending'
+            ''', ((channel, str(recipient)) for recipient, _ in failures))
+
+        try:
+            await self._write(operation)
+            recipients = [recipient for recipient, _ in failures]
+            if channel == 'tg':
+                self.subscribers.deactivate_tg_chats(recipients)
+            else:
+                self.subscribers.deactivate_yx_logins(recipients)
+            print(f"Отключено недоступных получателей {channel}: {len(failures)}")
+        except Exception as ex:
+            print("Ошибка отключения получателей: ", ex)
+
+    @timed(STORAGE_QUERY_SECONDS, 'get_media_file_id')
+    async def get_media_file_id(self, media_key, channel):
+        try:
+            row = await self._fetch(SQL_GET_MEDIA_FILE_ID, (media_key, channel), one=True)
+            return row[0] if row else None
+        except Exception as ex:
+            print("Ошибка получения file_id: ", ex)
+            return None
+
+    @timed(STORAGE_QUERY_SECONDS, 'save_media_file_id')
+    async def save_media_file_id(self, media_key, channel, file_id):
+        try:
+            await self._execute_write(
+                "INSERT OR REPLACE INTO media_cache (media_key, channel, file_id) VALUES (?, ?, ?)",
+                (media_key, channel, file_id)
+            )
+        except Exception as ex:
+            print("Ошибка сохранения file_id: ", ex)
+
+    @timed(STORAGE_QUERY_SECONDS, 'delete_media_file_id')
+    async def delete_media_file_id(self, media_key, channel, file_id):
+        try:
+            await self._execute_write(
+                "DELETE FROM media_cache WHERE media_key = ? AND channel = ? AND file_id = ?",
+                (media_key, channel, file_id)
+            )
+        except Exception as ex:
+            print("Ошибка удаления file_id: ", ex)
+
+    async def close(self):
+        if self._subscribers_task:
+            self._subscribers_task.cancel()
+            try:
+                await self._subscribers_task
+            except asyncio.CancelledError:
+                pass
+            self._subscribers_task = None
+        if self._writer_task:
+            # Писатель дописывает очередь до конца и останавливается
+            self._write_queue.put_nowait(None)
+            await self._writer_task
+            self._writer_task = None
+        for reader in self.readers:
+            await reader.close()
+        self.readers = []
+        self._idle_readers = []
+        if self.writer:
+            await self._in_writer_thread(self.writer.close)
+            self._writer_thread.shutdown()
+            print("Соединение с БД закрыто")
 
 async def main():
     async with NewsStorage() as storage:
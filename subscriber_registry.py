@@ -0,0 +1,141 @@
+from array import array
+
+
+class SubscriberRegistry:
+    # Копия подписчиков в памяти процесса. Заполняется при подключении к БД и заново,
+    # если БД изменил другой процесс; свои записи NewsStorage вносит сюда сама.
+    # Колонки хранятся в компактных массивах, словари - только индексы позиций.
+
+    def __init__(self):
+        self.tg_user_ids = array('q')
+        self.tg_chat_ids = array('q')
+        self.tg_active = bytearray()
+        self._tg_by_user = {}
+        self._tg_by_chat = {}
+
+        self.yx_logins = []
+        self.yx_active = bytearray()
+        self._yx_by_login = {}
+
+        # yx_login -> tg_id, как в первой строке user_tg_yx для логина
+        self.links = {}
+
+        self._active_tg = None
+        self._active_yx = None
+
+    def load(self, users_tg, users_yx, links):
+        # users_tg - строки (user_id, chat_id, is_active), users_yx - (login, is_active),
+        # links - (tg_id, yx_id) в порядке вставки
+        self.__init__()
+        for user_id, chat_id, is_active in users_tg:
+            self._append_tg(user_id, chat_id, is_active)
+        for login, is_active in users_yx:
+            self._append_yx(login, is_active)
+        for tg_id, yx_id in links:
+            self.links.setdefault(yx_id, tg_id)
+        print(f"Подписчики загружены в память: tg {len(self.tg_user_ids)}, yx {len(self.yx_logins)}")
+
+    def _append_tg(self, user_id, chat_id, is_active):
+        position = len(self.tg_user_ids)
+        self.tg_user_ids.append(user_id)
+        self.tg_chat_ids.append(chat_id)
+        self.tg_active.append(1 if is_active else 0)
+        self._tg_by_user[user_id] = position
+        self._tg_by_chat[chat_id] = position
+
+    def _remove_tg(self, position):
+        # Удаление перестановкой последнего элемента на место удаляемого
+        del self._tg_by_user[self.tg_user_ids[position]]
+        del self._tg_by_chat[self.tg_chat_ids[position]]
+
+        last = len(self.tg_user_ids) - 1
+        if position != last:
+            self.tg_user_ids[position] = self.tg_user_ids[last]
+            self.tg_chat_ids[position] = self.tg_chat_ids[last]
+            self.tg_active[position] = self.tg_active[last]
+            self._tg_by_user[self.tg_user_ids[position]] = position
+            self._tg_by_chat[self.tg_chat_ids[position]] = position
+
+        self.tg_user_ids.pop()
+        self.tg_chat_ids.pop()
+        self.tg_active.pop()
+
+    def _append_yx(self, login, is_active):
+        self._yx_by_login[login] = len(self.yx_logins)
+        self.yx_logins.append(login)
+        self.yx_active.append(1 if is_active else 0)
+
+    def put_tg(self, user_id, chat_id):
+        # Повторяет INSERT OR REPLACE: строки с тем же user_id или chat_id заменяются
+        position = self._tg_by_user.get(user_id)
+        if position is not None:
+            self._remove_tg(position)
+        position = self._tg_by_chat.get(chat_id)
+        if position is not None:
+            self._remove_tg(position)
+        self._append_tg(user_id, chat_id, True)
+        self._active_tg = None
+
+    def put_yx(self, login):
+        position = self._yx_by_login.get(login)
+        if position is None:
+            self._append_yx(login, True)
+        else:
+            self.yx_active[position] = 1
+        self._active_yx = None
+
+    def link(self, tg_id, yx_id):
+        self.links.setdefault(yx_id, tg_id)
+
+    def set_active_tg(self, user_id, is_active):
+        position = self._tg_by_user.get(user_id)
+        if position is not None:
+            self.tg_active[position] = 1 if is_active else 0
+            self._active_tg = None
+
+    def set_active_yx(self, login, is_active):
+        position = self._yx_by_login.get(login)
+        if position is not None:
+            self.yx_active[position] = 1 if is_active else 0
+            self._active_yx = None
+
+    def deactivate_tg_chats(self, chat_ids):
+        # Из outbox получатели приходят строками
+        for chat_id in chat_ids:
+            position = self._tg_by_chat.get(int(chat_id))
+            if position is not None:
+                self.tg_active[position] = 0
+        self._active_tg = None
+
+    def deactivate_yx_logins(self, logins):
+        for login in logins:
+            self.set_active_yx(login, False)
+
+    def is_active_tg(self, user_id):
+        position = self._tg_by_user.get(user_id)
+        return position is not None and self.tg_active[position] == 1
+
+    def is_active_yx(self, login):
+        position = self._yx_by_login.get(login)
+        return position is not None and self.yx_active[position] == 1
+
+    def has_yx(self, login):
+        return login in self._yx_by_login
+
+    def tg_id_by_yx(self, login):
+        return self.links.get(login)
+
+    def active_chat_ids(self):
+        # Список активных пересчитывается только после изменений
+        if self._active_tg is None:
+            self._active_tg = [
+                chat_id for chat_id, active in zip(self.tg_chat_ids, self.tg_active) if active
+            ]
+        return list(self._active_tg)
+
+    def active_logins(self):
+        if self._active_yx is None:
+            self._active_yx = [
+                login for login, active in zip(self.yx_logins, self.yx_active) if active
+            ]
+        return list(self._active_yx)
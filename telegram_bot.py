@@ -34,8 +34,9 @@ class Messages:
 
 class NewsBot:
 
-    def __init__(self, token , storage):
-        self.bot = Bot(token=token)
+    def __init__(self, token , storage, http_client=None):
+        session = http_client.aiogram_session() if http_client is not None else None
+        self.bot = Bot(token=token, session=session)
         self.dp = Dispatcher()
         self.storage = storage
 
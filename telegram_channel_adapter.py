@@ -10,8 +10,9 @@ from storage import NewsStorage
 
 class TelegramChannelAdapter():
 
-    def __init__(self, bot_token, channel_username, storage, yx_bot):
-        self.bot = Bot(token=bot_token)
+    def __init__(self, bot_token, channel_username, storage, yx_bot, http_client=None):
+        session = http_client.aiogram_session() if http_client is not None else None
+        self.bot = Bot(token=bot_token, session=session)
         self.bot_token = bot_token
         self.channel = channel_username
         self.storage = storage
@@ -102,7 +103,7 @@ class TelegramChannelAdapter():
 
     async def _send_yandex(self, message):
         try:
-            logins = await self.storage.get_all_activate_users_yx()
+            logins = self.storage.iter_active_users_yx()
             text = await self._parser_for_yandex(message.html_text)
 
             wrong_text = ["__", "**", "~~"]
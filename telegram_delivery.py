@@ -1,14 +1,60 @@
 import asyncio
+import json
+from datetime import timedelta
 from telegram import Bot
+from telegram.error import RetryAfter, Forbidden, BadRequest
 from config_loader import Config
 from telegram.constants import ParseMode
+from delivery_scheduler import DeliveryScheduler, RetryLater, PermanentFailure, dead_recipients, iter_windows
+from news_renderer import RUBRIC_EMOJIS
+
+# Ошибки BadRequest, после которых писать в чат бессмысленно
+DEAD_CHAT_ERRORS = (
+    'chat not found',
+    'user is deactivated',
+    'bot was blocked',
+    'bot was kicked',
+    'peer_id_invalid',
+)
+
+# Ошибки загрузки, при которых Telegram не принимает саму картинку - ее не получит никто
+BAD_PHOTO_ERRORS = (
+    'wrong type of the web page content',
+    'failed to get http url content',
+    'wrong file identifier/http url specified',
+    'photo_invalid_dimensions',
+    'photo_ext_invalid',
+    'photo_save_file_invalid',
+    'image_process_failed',
+    'file must be non-empty',
+)
+
+# Ошибки отправки по file_id из кэша: картинку нужно загрузить заново
+STALE_FILE_ID_ERRORS = (
+    'wrong file identifier',
+    'wrong remote file identifier',
+    'wrong padding',
+    'file reference expired',
+    'file_reference_expired',
+)
 
 class TelegramDelivery:
 
-    def __init__(self, bot_token, default_chat_id=None):
+    def __init__(self, bot_token, default_chat_id=None, global_rate=30, per_chat_rate=1,
+                 storage=None, image_loader=None, http_client=None):
         self.bot_token = bot_token
         self.default_chat_id = default_chat_id
-        self.bot = Bot(token=bot_token)
+        if http_client is not None:
+            self.bot = Bot(token=bot_token, request=http_client.telegram_request())
+        else:
+            self.bot = Bot(token=bot_token)
+        self.scheduler = DeliveryScheduler(global_rate, per_chat_rate, name='tg')
+        self.storage = storage
+        self.image_loader = image_loader
+        self._file_ids = {}
+        self._upload_locks = {}
+        # Картинки, которые Telegram не принял: такие новости уходят текстом
+        self._failed_photos = set()
 
     def _format_notification(self, news_item):
 
@@ -17,14 +63,7 @@ class TelegramDelivery:
         rubric = self._escape_html(news_item['rubric'])
         link = self._escape_html(news_item['link'])
 
-        rubric_emojis = {
-            'Anniversary time': '🎉',
-            'Career upgrade': '🚀',
-            'день рождения': '🎂',
-            'Без рубрики': '📰'
-        }
-    
-        emoji = rubric_emojis.get(rubric, '📌')
+        emoji = RUBRIC_EMOJIS.get(rubric, '📌')
 
         message = (
             f"{emoji} <b>{title}</b>\n\n"
@@ -34,6 +73,16 @@ class TelegramDelivery:
         )
 
         return message
+
+    def encode_payload(self, text, photo=None):
+        return json.dumps({"text": text, "photo": photo}, ensure_ascii=False)
+
+    def render_payload(self, news_item):
+        # Текст экранируется один раз на новость, при рассылке он не меняется
+        return self.encode_payload(
+            self._format_notification(news_item),
+            news_item.get('image_url')
+        )
     
     def _escape_html(self, text):
         if not text:
@@ -44,48 +93,190 @@ class TelegramDelivery:
         
 
 
-    async def send_notification(self, text, chat_id=None):
-        target_chat = chat_id or self.default_chat_id
-        print(target_chat)
+    @staticmethod
+    def _retry_seconds(retry_after):
+        if isinstance(retry_after, timedelta):
+            return retry_after.total_seconds()
+        return float(retry_after)
 
-        if not target_chat:
-            print("Не указан chat_id для отправки")
+    async def _cached_file_id(self, photo_url):
+        file_id = self._file_ids.get(photo_url)
+        if file_id is None and self.storage is not None:
+            file_id = await self.storage.get_media_file_id(photo_url, 'tg')
+            if file_id:
+                self._file_ids[photo_url] = file_id
+        return file_id
+
+    @staticmethod
+    def _is_dead_chat(ex):
+        return any(error in ex.message.lower() for error in DEAD_CHAT_ERRORS)
+
+    @staticmethod
+    def _is_bad_photo(ex):
+        return any(error in ex.message.lower() for error in BAD_PHOTO_ERRORS)
+
+    @staticmethod
+    def _is_stale_file_id(ex):
+        return any(error in ex.message.lower() for error in STALE_FILE_ID_ERRORS)
+
+    def _photo_failed(self, photo_url, reason):
+        self._failed_photos.add(photo_url)
+        self._file_ids.pop(photo_url, None)
+        self._upload_locks.pop(photo_url, None)
+        print(f"Картинка не отправлена ({reason}), новость уходит текстом: {photo_url}")
+
+    async def _forget_file_id(self, photo_url, file_id):
+        # Удаляется только этот file_id: другой получатель мог уже загрузить картинку заново
+        if self._file_ids.get(photo_url) == file_id:
+            del self._file_ids[photo_url]
+        if self.storage is not None:
+            await self.storage.delete_media_file_id(photo_url, 'tg', file_id)
+
+    async def _send_photo(self, chat_id, text, photo_url, reupload=True):
+        # False - картинку этому получателю отправить нельзя, вызывающий отправляет текст
+        file_id = self._file_ids.get(photo_url)
+
+        if file_id is None:
+            # Картинку загружает только первый получатель, остальные ждут его file_id
+            lock = self._upload_locks.setdefault(photo_url, asyncio.Lock())
+            async with lock:
+                if photo_url in self._failed_photos:
+                    return False
+
+                file_id = await self._cached_file_id(photo_url)
+                if file_id is None:
+                    return await self._upload_photo(chat_id, text, photo_url)
+
+        try:
+            await self.bot.send_photo(
+                chat_id = chat_id,
+                photo = file_id,
+                caption = text,
+                parse_mode = ParseMode.HTML
+            )
+        except BadRequest as ex:
+            if self._is_dead_chat(ex):
+                raise
+            if reupload and self._is_stale_file_id(ex):
+                # file_id больше не действителен: запись кэша удаляется, картинка загружается заново
+                await self._forget_file_id(photo_url, file_id)
+                return await self._send_photo(chat_id, text, photo_url, reupload=False)
+            print(f"Картинка не отправлена в чат {chat_id} ({ex.message}), новость уходит текстом")
             return False
+        return True
+
+    async def _upload_photo(self, chat_id, text, photo_url):
+        # Вызывается под блокировкой загрузки этой картинки
+        photo = photo_url
+        if self.image_loader is not None:
+            photo = await self.image_loader(photo_url)
+            if photo is None:
+                # Адрес на портале закрыт для Telegram, передавать его нет смысла
+                self._photo_failed(photo_url, "не удалось скачать")
+                return False
 
         try:
-            # message = self._format_notification(news_item)
-            await self.bot.send_message(
-                chat_id = target_chat,
-                text = text,
-                parse_mode = ParseMode.HTML,
-                disable_web_page_preview = True
+            message = await self.bot.send_photo(
+                chat_id = chat_id,
+                photo = photo,
+                caption = text,
+                parse_mode = ParseMode.HTML
             )
+        except BadRequest as ex:
+            if self._is_dead_chat(ex):
+                raise
+            if self._is_bad_photo(ex):
+                self._photo_failed(photo_url, ex.message)
+            else:
+                # Ошибка одного чата (например, нет прав на фото): следующий получатель загрузит сам
+                print(f"Картинка не отправлена в чат {chat_id} ({ex.message}), новость уходит текстом")
+            return False
+
+        file_id = message.photo[-1].file_id
+        self._file_ids[photo_url] = file_id
+        self._upload_locks.pop(photo_url, None)
+        if self.storage is not None:
+            await self.storage.save_media_file_id(photo_url, 'tg', file_id)
+        print(f"Картинка загружена в Telegram: {photo_url}")
+        return True
 
+    async def _deliver(self, chat_id, payload):
+        message = json.loads(payload)
+
+        try:
+            photo_url = message.get('photo')
+            sent = False
+            if photo_url and photo_url not in self._failed_photos:
+                sent = await self._send_photo(chat_id, message['text'], photo_url)
+
+            if not sent:
+                await self.bot.send_message(
+                    chat_id = chat_id,
+                    text = message['text'],
+                    parse_mode = ParseMode.HTML,
+                    disable_web_page_preview = True
+                )
             return True
 
+        except RetryAfter as ex:
+            raise RetryLater(self._retry_seconds(ex.retry_after))
+
+        except Forbidden as ex:
+            raise PermanentFailure(ex.message)
+
+        except BadRequest as ex:
+            if self._is_dead_chat(ex):
+                raise PermanentFailure(ex.message)
+            print(f"Ошибка отправки в Telegram: {ex}")
+            return False
+
         except Exception as e:
             print(f"Ошибка отправки в Telegram: {e}")
             return False
 
+    async def send_notification(self, text, chat_id=None):
+        target_chat = chat_id or self.default_chat_id
+        print(target_chat)
+
+        if not target_chat:
+            print("Не указан chat_id для отправки")
+            return False
+
+        try:
+            return await self._deliver(target_chat, self.encode_payload(text))
+        except RetryLater as ex:
+            print(f"Превышен лимит Telegram, повтор через {ex.retry_after} с")
+            return False
+        except PermanentFailure as ex:
+            print(f"Чат {target_chat} недоступен: {ex.reason}")
+            return False
+
+    async def deliver_batch(self, messages, attempts=None):
+        results = await self.scheduler.run(messages, self._deliver, attempts)
+
+        dead = dead_recipients(messages, results)
+        if dead and self.storage is not None:
+            await self.storage.deactivate_recipients('tg', dead)
+
+        return results
+
     async def send_to_many(self, text, chat_ids):
-        
+        # chat_ids - список или асинхронный генератор пачек из NewsStorage.iter_active_users_tg
         try:
-            tasks = []
-            for chat_id in chat_ids:
-                task = self.send_notification(text, chat_id)
-                tasks.append(task)
-            
-            results = await asyncio.gather(*tasks, return_exceptions=True)
+            payload = self.encode_payload(text)
 
             successful = 0
             failed = 0
 
+            async for window in iter_windows(chat_ids):
+                results = await self.deliver_batch([(chat_id, payload) for chat_id in window])
+                for result in results:
+                    if result is True:
+                        successful += 1
+                    else:
+                        failed += 1
+
             print(f"Отправлено в Telegram!")
-            for result in results:
-                if isinstance(result, bool) and result:
-                    successful += 1
-                else:
-                    failed += 1
             
             print(f"Результат отпрвки: успешно - {successful}, неудачно - {failed}")
             return successful
@@ -1,17 +1,57 @@
+import hmac
 from aiohttp import web
+from metrics import REGISTRY
 
 class WebhookServer:
 
-    def __init__(self, bot, host, port):
+    def __init__(self, bot, host, port, dispatcher=None, hr_webhook_secret=None):
         self.bot = bot
         self.host = host
         self.port = port
+        # Прием новостей HR-портала включается, только если задан общий секрет
+        self.dispatcher = dispatcher
+        self.hr_webhook_secret = hr_webhook_secret
         self.app = web.Application()
         self.runner = None
         self._setup_routes()
 
     def _setup_routes(self):
         self.app.router.add_post('/webhook', self.bot.handle_webhook)
+        self.app.router.add_get('/metrics', self.handle_metrics)
+        if self.dispatcher is not None and self.hr_webhook_secret:
+            self.app.router.add_post('/hr/webhook', self.handle_hr_webhook)
+
+    async def handle_hr_webhook(self, request):
+        # Тело: {"event": "news.created" | "news.updated", "items": [...]} или {"item": {...}},
+        # новости в том же формате, что data.items в ответе API портала
+        secret = request.headers.get('X-Webhook-Secret', '')
+        if not hmac.compare_digest(secret.encode(), self.hr_webhook_secret.encode()):
+            return web.Response(text='Forbidden', status=403)
+
+        try:
+            data = await request.json()
+            items = data['items'] if 'items' in data else [data['item']]
+            if not isinstance(items, list):
+                raise ValueError("items должен быть списком")
+        except Exception as ex:
+            print(f"Некорректный веб-хук HR-портала: {ex}")
+            return web.Response(text='Bad Request', status=400)
+
+        try:
+            accepted = await self.dispatcher.ingest_pushed(items)
+        except Exception as ex:
+            print(f"Ошибка обработки веб-хука HR-портала: {ex}")
+            return web.Response(text='Error', status=500)
+
+        print(f"Веб-хук HR-портала {data.get('event', '')}: новых новостей {accepted}")
+        return web.json_response({'ok': True, 'accepted': accepted})
+
+    async def handle_metrics(self, request):
+        return web.Response(
+            text=REGISTRY.render(),
+            content_type='text/plain',
+            headers={'X-Content-Type-Options': 'nosniff'}
+        )
     
     async def start(self):
         self.runner = web.AppRunner(self.app)
@@ -8,8 +8,26 @@ from webhook_server import WebhookServer
 from storage import NewsStorage
 from yandex_adapter import YandexAdapter
 import html
+import os
 import re
 from telegram_delivery import TelegramDelivery
+from delivery_scheduler import DeliveryScheduler, PermanentFailure, dead_recipients, iter_windows
+from image_cache import ImageCache
+from news_renderer import RUBRIC_EMOJIS
+
+# Ответы API, после которых писать на логин бессмысленно: только ошибки про
+# конкретного получателя. Общие "Forbidden" / "Not Found" бывают и у самого бота
+# (отозванный токен, неверный адрес API) - из-за них аудиторию отключать нельзя.
+DEAD_LOGIN_STATUSES = (400, 403, 404)
+DEAD_LOGIN_ERRORS = (
+    'unknown login',
+    'login not found',
+    'user not found',
+    'chat not found',
+    'user is blocked',
+    'bot is blocked',
+    'blocked by user',
+)
 
 class BotCommand():
     SUBSCRIBE_TG = "Подписаться на рассылку в Telegram"
@@ -54,14 +72,18 @@ class YandexDeliveryBot:
     THIN_SPACE = '\u2009'
     BUTTON_WIDTH = 60
     
-    def __init__(self, config: YandexBotConfig, storage, bot_tg: TelegramDelivery):
+    def __init__(self, config: YandexBotConfig, storage, bot_tg: TelegramDelivery,
+                 global_rate=50, per_chat_rate=5, http_client=None):
         self.count = 0
         self.config = config
         self.storage = storage
+        self.http_client = http_client
         self._session = None
         self._setup_ui_texts()
         self._setup_headers()
         self.bot_tg = bot_tg
+        self.scheduler = DeliveryScheduler(global_rate, per_chat_rate, name='yx')
+        self.image_cache = ImageCache()
 
     def _setup_ui_texts(self):
 
@@ -91,32 +113,67 @@ class YandexDeliveryBot:
         ]]
 
         self.keyboard.append({"text": self.link_telegram, "url": "https://t.me/universe_data_bot" })
+        self._keyboard_json = json.dumps(self.keyboard, ensure_ascii=False)
     
     def _setup_headers(self):
         self.headers = {"Authorization": f"OAuth {self.config.bot_token}"}
+        self.json_headers = {**self.headers, "Content-Type": "application/json"}
     
     async def _get_session(self):
+        if self.http_client is not None:
+            return await self.http_client.get_session()
         if self._session is None or self._session.closed:
             self._session = aiohttp.ClientSession()
         return self._session
 
     async def close(self):
+        # Общий пул закрывает HttpClient, здесь только собственная сессия
         if self._session and not self._session.closed:
             await self._session.close()
 
     async def _make_request(self, method: str, url: str, **kwargs):
+        _, data = await self._request_with_status(method, url, **kwargs)
+        return data
+
+    async def _request_with_status(self, method: str, url: str, **kwargs):
+        # (HTTP-статус, JSON ответа); (None, None) - запрос не выполнен
         try:
             session = await self._get_session()
-            kwargs['headers'] = self.headers
+            kwargs.setdefault('headers', self.headers)
 
             async with session.request(method, url, **kwargs) as response:
-                return await response.json()
+                try:
+                    return response.status, await response.json(content_type=None)
+                except ValueError:
+                    return response.status, None
         except Exception as ex:
             print("Ошибка: ", ex)
+            return None, None
     
+    def encode_payload(self, text: str, keyboard: str = None):
+        # Тело запроса без поля login: '"text":...}' в байтах.
+        # Получатель подставляется в _send_payload без повторной сериализации текста.
+        tail = '"text":' + json.dumps(text, ensure_ascii=False)
+        if keyboard is not None:
+            tail += ',"inline_keyboard":' + keyboard
+        return (tail + '}').encode()
+
+    async def _send_payload(self, login: str, payload: bytes):
+        _, data = await self._post_payload(login, payload)
+        return data
+
+    async def _post_payload(self, login: str, payload: bytes):
+        body = b'{"login":' + json.dumps(login).encode() + b',' + payload
+        return await self._request_with_status(
+            'POST',
+            self.config.send_message_url,
+            data=body,
+            headers=self.json_headers
+        )
+
     async def send_message_with_buttons(self, login: str, text: str, btn=None):
         if btn is None:
-            btn = self.keyboard
+            return await self._send_payload(login, self.encode_payload(text, self._keyboard_json))
         return await self._make_request(
             'POST',
             self.config.send_message_url,
@@ -127,15 +184,41 @@ class YandexDeliveryBot:
             }
         )
 
-    async def send_image(self, login: str, image: bytes):
+    async def send_image(self, login: str, image):
+        # image - байты или путь к файлу из image_cache
+        if isinstance(image, bytes):
+            image = await self.image_cache.put(image)
+
         url = self.config.send_image_url
-        data = aiohttp.FormData()
-        data.add_field('login', login)
-        data.add_field('image', image)
-        
         session = await self._get_session()
-        async with session.post(url, headers=self.headers, data=data) as resp:
-            return await resp.json()
+
+        # Файл отдается в запрос потоком, тело не собирается в памяти
+        with open(image, 'rb') as f:
+            data = aiohttp.FormData()
+            data.add_field('login', login)
+            data.add_field('image', f, filename=os.path.basename(image))
+
+            async with session.post(url, headers=self.headers, data=data) as resp:
+                return await resp.json()
+
+    async def _deliver_image(self, login, path):
+        try:
+            response = await self.send_image(login, path)
+            return bool(response and response.get('ok', False))
+        except Exception as ex:
+            print(f"Ошибка отправки картинки в Яндекс Мессенджер: {ex}")
+            return False
+
+    async def send_image_to_many(self, logins, image: bytes):
+        path = await self.image_cache.put(image)
+        successful = 0
+        total = 0
+        async for window in iter_windows(logins):
+            results = await self.scheduler.run([(login, path) for login in window], self._deliver_image)
+            successful += sum(1 for result in results if result is True)
+            total += len(results)
+        print(f"Картинка отправлена: успешно - {successful}, неудачно - {total - successful}")
+        return successful
 
     async def send_message(self, login: str, text: str):
         response = await self._make_request(
@@ -320,14 +403,7 @@ class YandexDeliveryBot:
         rubric = news_item['rubric']
         link = news_item['link']
 
-        rubric_emojis = {
-            'Anniversary time': '🎉',
-            'Career upgrade': '🚀',
-            'день рождения': '🎂',
-            'Без рубрики': '📰'
-        }
-    
-        emoji = rubric_emojis.get(rubric, '📌')
+        emoji = RUBRIC_EMOJIS.get(rubric, '📌')
 
         message = (
             f"{emoji} **{title}**\n\n"
@@ -337,6 +413,9 @@ class YandexDeliveryBot:
         )
 
         return message
+
+    def render_payload(self, news_item):
+        return self.encode_payload(self._format_notification(news_item))
     
     async def parser_for_tg(self, text):
         text = html.escape(text)
@@ -365,24 +444,45 @@ class YandexDeliveryBot:
             print(f"Ошибка отправки в Яндекс Мессенджер: {ex}")
             return False
 
+    async def _deliver(self, login, payload):
+        status, response = await self._post_payload(login, payload)
+        if response and response.get('ok', False):
+            return True
+
+        description = str((response or {}).get('description', ''))
+        if status in DEAD_LOGIN_STATUSES and any(error in description.lower() for error in DEAD_LOGIN_ERRORS):
+            raise PermanentFailure(description)
+
+        if status in (401, 403):
+            # Ошибка бота, а не получателя: сообщение останется в очереди
+            print(f"Яндекс Мессенджер отклонил запрос бота ({status}): {description}")
+        return False
+
+    async def deliver_batch(self, messages, attempts=None):
+        results = await self.scheduler.run(messages, self._deliver, attempts)
+
+        dead = dead_recipients(messages, results)
+        if dead and self.storage is not None:
+            await self.storage.deactivate_recipients('yx', dead)
+
+        return results
+
     async def send_to_many(self, logins, text):
         try:
-            tasks = []
-            for login in logins:
-                task = self.send_message(login, text)
-                tasks.append(task)
-            
-            results = await asyncio.gather(*tasks, return_exceptions=True)
+            payload = self.encode_payload(text)
 
             successful = 0
             failed = 0
 
+            async for window in iter_windows(logins):
+                results = await self.deliver_batch([(login, payload) for login in window])
+                for result in results:
+                    if result is True:
+                        successful += 1
+                    else:
+                        failed += 1
+
             print(f"Отправлено в Яндекс Мессенджер!")
-            for result in results:
-                if isinstance(result, bool) and result:
-                    successful += 1
-                else:
-                    failed += 1
             
             print(f"Результат отпрвки: успешно - {successful}, неудачно - {failed}")
             return successful
@@ -393,11 +493,11 @@ class YandexDeliveryBot:
     
 
     async def __aenter__(self):
-        self._session = aiohttp.ClientSession()
+        await self._get_session()
         return self
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self._session.close()
+        await self.close()
         print("Сессия закрыта")
     
 